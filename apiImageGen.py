@@ -1,10 +1,9 @@
 import base64
 import aiohttp
 from aiohttp import FormData
-from PIL import Image
-import io
 import json
 import configparser
+from imageHandle import ImageHandle
 
 # Read the configuration
 config = configparser.ConfigParser()
@@ -47,20 +46,17 @@ async def generate_images(prompt: str,negative_prompt: str,interaction):
     images = []
     for i, image in enumerate(data["artifacts"]):
         img_data = base64.b64decode(image["base64"])
-        img = Image.open(io.BytesIO(img_data))
-        images.append(img)
+        images.append(ImageHandle(img_data))
 
     return images
 
 
-async def generate_alternatives(image: Image.Image, prompt: str, negative_prompt: str):
+async def generate_alternatives(image: ImageHandle, prompt: str, negative_prompt: str):
     if api_key is None:
         raise Exception("Missing Stability API key.")
 
-    # Convert the PIL Image to bytes
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    image_bytes = buffered.getvalue()
+    # Original encoded bytes, no PNG re-encode needed
+    image_bytes = image.data
 
     # Create FormData object
     data = FormData()
@@ -94,19 +90,16 @@ async def generate_alternatives(image: Image.Image, prompt: str, negative_prompt
     alternatives = []
     for i, image in enumerate(data["artifacts"]):
         img_data = base64.b64decode(image["base64"])
-        img = Image.open(io.BytesIO(img_data))
-        alternatives.append(img)
+        alternatives.append(ImageHandle(img_data))
 
     return alternatives
 
-async def upscale_image(image: Image.Image, prompt: str,negative_prompt: str):
+async def upscale_image(image: ImageHandle, prompt: str,negative_prompt: str):
     if api_key is None:
         raise Exception("Missing Stability API key.")
 
-    # Convert the PIL Image to bytes
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    image_bytes = buffered.getvalue()
+    # Original encoded bytes, no PNG re-encode needed
+    image_bytes = image.data
 
     # Create FormData object
     data = FormData()
@@ -136,7 +129,7 @@ async def upscale_image(image: Image.Image, prompt: str,negative_prompt: str):
                 raise Exception(f"Non-200 response: {await response.text()}")
             upscaled_image_bytes = await response.read()
 
-    # Convert the bytes to a PIL Image
-    upscaled_image = Image.open(io.BytesIO(upscaled_image_bytes))
+    # Keep the encoded bytes, decoding only happens if pixels are needed
+    upscaled_image = ImageHandle(upscaled_image_bytes)
 
     return upscaled_image
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+Benchmark: tempo e tamanho da colagem de 4 imagens SDXL (1024x1024) em cada formato.
+
+Antes: canvas em tamanho cheio + PNG com compressão padrão (o que o bot gravava em ./out).
+Depois: build_collage com PNG rápido, WebP ou JPEG, em tamanho cheio e reduzido.
+As imagens de teste são PNGs com gradiente, formas e ruído, para o encoder não ter
+vida fácil demais com áreas lisas.
+
+Uso (na raiz do repositório):
+    python benchmarks/bench_collage.py [repetições]
+"""
+import os
+import random
+import sys
+import time
+from io import BytesIO
+from math import ceil, sqrt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from collage import build_collage
+from imageHandle import ImageHandle
+
+SIZE = 1024
+COUNT = 4
+
+
+def make_image(seed):
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((SIZE, SIZE)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x, y = rng.randrange(SIZE), rng.randrange(SIZE)
+        r = rng.randrange(20, 200)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    image = image.filter(ImageFilter.GaussianBlur(3))
+    noise = Image.effect_noise((SIZE, SIZE), 24).convert('RGB')
+    image = Image.blend(image, noise, 0.15)
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return ImageHandle(buffer.getvalue(), f'bench_{seed}.png')
+
+
+def collage_before(images):
+    # Cópia da create_collage antiga (sem gravar em disco, para medir só CPU)
+    num_cols = ceil(sqrt(len(images)))
+    num_rows = ceil(len(images) / num_cols)
+    collage = Image.new('RGB', (max(i.width for i in images) * num_cols, max(i.height for i in images) * num_rows))
+    for idx, image in enumerate(images):
+        with image.decode() as pixels:
+            collage.paste(pixels, ((idx % num_cols) * image.width, (idx // num_cols) * image.height))
+    buffer = BytesIO()
+    collage.save(buffer, format='PNG')
+    return buffer.getvalue(), '.png'
+
+
+def measure(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data, _ = func()
+        best = min(best, time.perf_counter() - start)
+    return best, len(data)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    images = [make_image(seed) for seed in range(COUNT)]
+
+    cases = [('antes: PNG padrão, 2048px', lambda: collage_before(images))]
+    for max_side in (0, 1024):
+        label = f'{max_side}px' if max_side else 'tamanho cheio'
+        for image_format in ('png', 'webp', 'jpeg'):
+            cases.append((f'{image_format}, {label}',
+                          lambda f=image_format, m=max_side: build_collage(images, m, f)))
+
+    print(f"{COUNT} imagens {SIZE}x{SIZE}, melhor de {repeat}")
+    baseline = None
+    for label, func in cases:
+        seconds, size = measure(func, repeat)
+        baseline = baseline or seconds
+        print(f"{label:28} {seconds * 1000:8.1f} ms  {size / 1024:8.0f} KB  ({baseline / seconds:4.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+"""
+Teste de carga dos handlers do bot.py com um Discord falso e a geração simulada.
+
+Os handlers de verdade (/gerar, /genplus e os botões Re-roll, V1-V4, U1-U4 e 1-4, ou os menus
+que os substituem acima de 5 imagens) recebem interações falsas, cujo send_message /
+edit_original_response / channel.send só esperam
+--latency e anotam o instante. A geração é trocada por um stub que espera --gen-time,
+manda o status de progresso como o imageGen e devolve PNGs reais; colagem, pasta de
+saída, agendador, single-flight, lote de re-rolls e StatusCoalescer são os do bot.
+
+Cada rodada dispara --commands comandos e --clicks cliques ao mesmo tempo e mostra a
+latência dos handlers (até a primeira resposta e até o fim), edições por job, pico de
+chamadas ao Discord por segundo e a memória (tracemalloc) depois da rodada. A primeira rodada é
+aquecimento: a memória que cresce nas seguintes é o que estaria vazando.
+
+Uso (na raiz do repositório):
+    python benchmarks/bench_discord_handlers.py [--commands 300] [--clicks 200] [--rounds 3]
+                                                [--gen-time 0.2] [--latency 0.05] [--in-flight 8]
+"""
+import argparse
+import asyncio
+import configparser
+import gc
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import discord
+from discord import app_commands
+from discord.ui.select import selected_values
+from PIL import Image
+
+from bench_end_to_end import CONFIG_TEMPLATE, percentile
+from fake_comfyui import tag_png
+from imageHandle import ImageHandle
+
+PROMPTS = ("1girl, cyberpunk city, rain", "a cat in a spaceship", "castle on a hill, sunset", "portrait, oil painting")
+CHECKPOINTS = ("anime/novaAnimeXL_ilV140.safetensors", "Real/juggernautXL_ragnarokBy.safetensors")
+SAMPLER_STEPS = 10
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        await self._interaction.record('send_message')
+
+    async def defer(self, **kwargs):
+        self._done = True
+        await self._interaction.record('defer')
+
+
+class FakeChannel:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self._interaction.record('channel_send')
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self._interaction.record('followup_send')
+
+
+class FakeInteraction(discord.Interaction):
+    """
+    Só o que o bot usa de uma interação. O __init__ do discord.Interaction não é chamado
+    (ele precisa do payload do gateway); o id é um snowflake de agora, então created_at
+    e o tempo de expiração funcionam como no Discord.
+    """
+    _ids = itertools.count()
+
+    def __init__(self, harness, kind, user_id, guild_id):
+        self.id = discord.utils.time_snowflake(discord.utils.utcnow()) + next(self._ids) % (1 << 22)
+        self.user = FakeUser(user_id)
+        self.guild_id = guild_id
+        self.channel = FakeChannel(self)
+        self._fake_response = FakeResponse(self)
+        self.harness = harness
+        self.kind = kind
+        self.calls = []  # (segundos desde o clique, tipo da chamada)
+        self.started = time.perf_counter()
+
+    @property
+    def response(self):
+        return self._fake_response
+
+    @property
+    def followup(self):
+        return FakeFollowup(self)
+
+    async def record(self, call):
+        await asyncio.sleep(self.harness.latency)
+        now = time.perf_counter()
+        self.calls.append((now - self.started, call))
+        self.harness.call_times.append(now)
+
+    async def edit_original_response(self, **kwargs):
+        await self.record('edit')
+
+    async def delete_original_response(self):
+        await self.record('delete')
+
+
+class FakeBackend:
+    """Troca generate_images / generate_images_plus / generate_alternatives / upscale_image do bot."""
+
+    def __init__(self, gen_time, image_size):
+        self.gen_time = gen_time
+        self.counter = itertools.count()
+        self.bases = []
+        for shade in range(4):
+            image = Image.linear_gradient('L').resize((image_size, image_size)).convert('RGB')
+            noise = Image.effect_noise((image_size, image_size), 32).convert('RGB')
+            tint = Image.new('RGB', (image_size, image_size), (60 * shade, 40, 120))
+            buffer = BytesIO()
+            Image.blend(Image.blend(image, noise, 0.2), tint, 0.3).save(buffer, format='PNG', compress_level=1)
+            self.bases.append(buffer.getvalue())
+        self.calls = Counter()
+
+    def images(self, count):
+        return [ImageHandle(tag_png(self.bases[index % len(self.bases)], str(next(self.counter))), f"stub_{index}.png")
+                for index in range(count)]
+
+    async def run(self, kind, status_callback, count):
+        # Mesma sequência de avisos do imageGen: fila, nó e passos do sampler
+        self.calls[kind] += 1
+        if status_callback:
+            await status_callback("⏳ Na fila: Posição 1")
+            await status_callback("🎨 Desenhando")
+        for step in range(1, SAMPLER_STEPS + 1):
+            await asyncio.sleep(self.gen_time / SAMPLER_STEPS)
+            if status_callback:
+                await status_callback(f"🎨 Desenhando {step}/{SAMPLER_STEPS} ({step * self.gen_time / SAMPLER_STEPS:.0f}s)")
+        return self.images(count)
+
+    async def generate_images(self, prompt, negative_prompt, steps=25, cfg=7.0, sampler_name=None, scheduler=None,
+                              ckpt_name=None, status_callback=None, count=None):
+        return await self.run('gerar', status_callback, count or 4)
+
+    async def generate_images_plus(self, prompt, negative_prompt, steps=25, cfg=7.0, sampler_name=None, scheduler=None,
+                                   ckpt_name=None, status_callback=None, count=None):
+        return await self.run('genplus', status_callback, count or 4)
+
+    async def generate_alternatives(self, image, prompt, negative_prompt, steps=None, cfg=None, sampler_name=None,
+                                    scheduler=None, ckpt_name=None, status_callback=None):
+        return await self.run('variacao', status_callback, 4)
+
+    async def upscale_image(self, image, prompt, negative_prompt, ckpt_name=None, status_callback=None):
+        return (await self.run('upscale', status_callback, 1))[0]
+
+
+class Harness:
+    def __init__(self, bot, backend, args):
+        self.bot = bot
+        self.backend = backend
+        self.args = args
+        self.latency = args.latency
+        self.rng = random.Random(args.seed)
+        self.call_times = []
+        self.views = []
+
+    def new_interaction(self, kind):
+        user_id = self.rng.randrange(self.args.users)
+        return FakeInteraction(self, kind, 1000 + user_id, 1 + user_id % self.args.guilds)
+
+    def command(self):
+        command = self.rng.choice((self.bot.slash_command, self.bot.slash_command, self.bot.gerarplus_command))
+        interaction = self.new_interaction(command.name)
+        checkpoint = self.rng.choice((None, *CHECKPOINTS))
+        options = {
+            'prompt': self.rng.choice(PROMPTS),
+            'quantidade': self.rng.choice((None, 2, 4)),
+            'checkpoint': checkpoint and app_commands.Choice(name=os.path.basename(checkpoint), value=checkpoint),
+        }
+        return interaction, command.callback(interaction, **options)
+
+    def click(self):
+        view = self.rng.choice(self.views)
+        item = self.rng.choice(view.children)
+        if isinstance(item, discord.ui.Select):
+            option = self.rng.choice(item.options)
+            label, coro = option.label, self.select(item, option.value)
+        else:
+            label, coro = item.label, None
+        kind = 'reroll' if label == 'Re-roll' else {'V': 'variacao', 'U': 'upscale'}.get(label[0], 'imagem')
+        interaction = self.new_interaction(kind)
+        return interaction, (coro(interaction) if coro else item.callback(interaction))
+
+    @staticmethod
+    def select(item, value):
+        # Como o discord.py faz ao receber a interação: os valores escolhidos ficam no contexto da task
+        async def run(interaction):
+            selected_values.set({item.custom_id: [value]})
+            await item.callback(interaction)
+        return run
+
+    async def run_round(self):
+        self.call_times.clear()
+        jobs = [self.command() for _ in range(self.args.commands)] + [self.click() for _ in range(self.args.clicks)]
+        self.rng.shuffle(jobs)
+
+        async def timed(interaction, coro):
+            try:
+                await coro
+            except Exception as e:
+                interaction.calls.append((time.perf_counter() - interaction.started, f'erro: {e!r}'))
+            return interaction, time.perf_counter() - interaction.started
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed(interaction, coro) for interaction, coro in jobs))
+        return results, time.perf_counter() - start
+
+
+def peak_per_second(times):
+    if not times:
+        return 0
+    times = sorted(times)
+    peak, first = 0, 0
+    for last, now in enumerate(times):
+        while now - times[first] > 1.0:
+            first += 1
+        peak = max(peak, last - first + 1)
+    return peak
+
+
+def report(round_number, results, elapsed, harness):
+    by_kind = defaultdict(list)
+    errors = Counter()
+    for interaction, latency in results:
+        by_kind[interaction.kind].append((interaction, latency))
+        errors.update(call for _, call in interaction.calls if call.startswith('erro'))
+    label = 'aquecimento' if round_number == 0 else f'rodada {round_number}'
+    print(f"\n{label}: {len(results)} interações em {elapsed:.2f} s, pico de {peak_per_second(harness.call_times)} "
+          f"chamadas ao Discord por segundo")
+    print(f"{'tipo':10} {'n':>5} {'1ª resp p50':>12} {'1ª resp p99':>12} {'fim p50':>9} {'fim p99':>9} "
+          f"{'edições/job':>12} {'envios/job':>11}")
+    for kind, entries in sorted(by_kind.items()):
+        first = [calls[0][0] for interaction, _ in entries if (calls := interaction.calls)]
+        total = [latency for _, latency in entries]
+        edits = sum(call == 'edit' for interaction, _ in entries for _, call in interaction.calls)
+        sends = sum(call in ('channel_send', 'followup_send') for interaction, _ in entries for _, call in interaction.calls)
+        print(f"{kind:10} {len(entries):5} {percentile(first, 50) * 1000:10.0f}ms {percentile(first, 99) * 1000:10.0f}ms "
+              f"{percentile(total, 50):8.2f}s {percentile(total, 99):8.2f}s {edits / len(entries):12.1f} "
+              f"{sends / len(entries):11.1f}")
+    for error, count in errors.most_common(5):
+        print(f"  {count}x {error}")
+
+
+async def main_async(args, bot):
+    backend = FakeBackend(args.gen_time, args.image_size)
+    for name in ('generate_images', 'generate_images_plus', 'generate_alternatives', 'upscale_image'):
+        setattr(bot, name, getattr(backend, name))
+    harness = Harness(bot, backend, args)
+    harness.views = [
+        bot.Buttons(PROMPTS[index % len(PROMPTS)], "", backend.images((4, 8)[index % 2]), CHECKPOINTS[index % len(CHECKPOINTS)],
+                    25, 6.0, "euler_ancestral", "normal", is_plus=index % 3 == 0)
+        for index in range(args.views)
+    ]
+
+    tracemalloc.start(args.frames)
+    baseline = None
+    for round_number in range(args.rounds + 1):
+        results, elapsed = await harness.run_round()
+        report(round_number, results, elapsed, harness)
+        del results
+        await asyncio.sleep(0)
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"memória: {current / 1024 / 1024:.1f} MB agora, pico {peak / 1024 / 1024:.1f} MB")
+        tracemalloc.reset_peak()
+        if baseline is None:
+            baseline = snapshot
+
+    print(f"\ncrescimento depois do aquecimento (top {args.top}):")
+    for stat in snapshot.compare_to(baseline, 'lineno')[:args.top]:
+        print(f"  {stat}")
+    print(f"\ngeração simulada: {dict(backend.calls)}")
+    print(f"status: {bot.status_updates.stats()}, agendador: {bot.job_scheduler.stats()}")
+    print(f"executor de imagens: {bot.image_executor.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga dos handlers do bot com Discord falso")
+    parser.add_argument('--commands', type=int, default=300, help="/gerar e /genplus por rodada")
+    parser.add_argument('--clicks', type=int, default=200, help="cliques em botões por rodada")
+    parser.add_argument('--rounds', type=int, default=3, help="rodadas medidas, depois do aquecimento")
+    parser.add_argument('--gen-time', type=float, default=0.2, help="segundos de cada geração simulada")
+    parser.add_argument('--latency', type=float, default=0.05, help="segundos de cada chamada ao Discord")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--views', type=int, default=20, help="mensagens com botões para clicar")
+    parser.add_argument('--in-flight', type=int, default=8, help="JOBS_MAX_IN_FLIGHT do agendador")
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--image-executor', choices=('process', 'thread'), default='process')
+    parser.add_argument('--frames', type=int, default=1, help="quadros de pilha guardados pelo tracemalloc")
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # O bot lê o config.properties da pasta atual ao ser importado; a pasta de saída fica aqui também
+        config = configparser.ConfigParser()
+        config.read_string(CONFIG_TEMPLATE.format(servers='127.0.0.1:1', websocket_outputs='false'))
+        config['BOT'].update({
+            'OUTPUT_DIR': os.path.join(workdir, 'out'),
+            'JOBS_MAX_IN_FLIGHT': str(args.in_flight),
+            'JOBS_PER_GUILD': str(max(3, args.in_flight)),
+            'IMAGE_EXECUTOR': args.image_executor,
+        })
+        config['CHECKPOINTS'] = {'FILES': ', '.join(CHECKPOINTS), 'DEFAULT': CHECKPOINTS[0]}
+        with open(os.path.join(workdir, 'config.properties'), 'w', encoding='utf-8') as file:
+            config.write(file)
+        os.chdir(workdir)
+        import bot
+        try:
+            asyncio.run(main_async(args, bot))
+        finally:
+            bot.image_executor.close()
+            os.chdir(ROOT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+Benchmark ponta a ponta: imageGen contra o ComfyUI falso (benchmarks/fake_comfyui.py).
+
+Roda --jobs jobs, --concurrency por vez, misturando generate_images, generate_alternatives
+e upscale_image (--mix), e mede vazão, latência p50/p99 por tipo e o atraso do event loop
+(quanto um sleep de 10 ms passa do tempo), que é o que o heartbeat do Discord sentiria.
+
+Os servidores falsos rodam em outros processos, para o custo deles não entrar no event
+loop medido. Com --speed 0 a "GPU" é instantânea e sobra só o custo do lado do bot;
+com --speed 1 os tempos são parecidos com os de SDXL numa GPU de verdade.
+
+Uso (na raiz do repositório):
+    python benchmarks/bench_end_to_end.py [--jobs 200] [--concurrency 16] [--speed 0.01] [--servers 1]
+                                          [--mix gerar=6,variacao=2,upscale=1]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from math import ceil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FAKE_SERVER = os.path.join(ROOT, 'benchmarks', 'fake_comfyui.py')
+WORKFLOWS = os.path.join(ROOT, 'comfyUI-workflows')
+
+PROMPT = "1girl, cyberpunk city, rain, neon lights"
+NEGATIVE = "bad hands, blurry"
+CHECKPOINTS = ("anime/novaAnimeXL_ilV140.safetensors", "Real/juggernautXL_ragnarokBy.safetensors")
+
+# Os workflows de exemplo do repositório, com os IDs de nó de cada um
+CONFIG_TEMPLATE = f"""
+[BOT]
+TOKEN = bench
+SDXL_SOURCE = LOCAL
+
+[LOCAL]
+SERVER_ADDRESS = {{servers}}
+WEBSOCKET_OUTPUTS = {{websocket_outputs}}
+
+[LOCAL_TEXT2IMG]
+CONFIG = {os.path.join(WORKFLOWS, 'text2img_config.json')}
+PROMPT_NODES = 6, 12
+NEG_PROMPT_NODES = 7, 13
+RAND_SEED_NODES = 17, 20
+CHECKPOINT_NODES = 4
+SAMPLER_NODES = 17
+OUTPUT_NODES = 19
+
+[LOCAL_TEXT2IMG_PLUS]
+CONFIG = {os.path.join(WORKFLOWS, 'text2img_config.json')}
+PROMPT_NODES = 6, 12
+NEG_PROMPT_NODES = 7, 13
+RAND_SEED_NODES = 17, 20
+CHECKPOINT_NODES = 4
+SAMPLER_NODES = 17
+OUTPUT_NODES = 19
+
+[LOCAL_IMG2IMG]
+CONFIG = {os.path.join(WORKFLOWS, 'img2img_config.json')}
+PROMPT_NODES = 2
+NEG_PROMPT_NODES = 3
+RAND_SEED_NODES = 4
+CHECKPOINT_NODES = 1
+SAMPLER_NODES = 4
+FILE_INPUT_NODES = 5
+OUTPUT_NODES = 8
+
+[LOCAL_UPSCALE]
+CONFIG = {os.path.join(WORKFLOWS, 'upscale_config.json')}
+RAND_SEED_NODES = 6
+CHECKPOINT_NODES = 12
+FILE_INPUT_NODES = 1
+UPSCALE_MODEL_NODES = 3
+OUTPUT_NODES = 44
+"""
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, ceil(q / 100 * len(ordered)) - 1))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_servers(count, args):
+    servers = []
+    for _ in range(count):
+        port = free_port()
+        command = [sys.executable, FAKE_SERVER, '--port', str(port), '--speed', str(args.speed),
+                   '--max-side', str(args.max_side)]
+        servers.append((f'127.0.0.1:{port}', subprocess.Popen(command, stdout=subprocess.DEVNULL)))
+    for address, process in servers:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                urllib.request.urlopen(f'http://{address}/system_stats', timeout=1).read()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"ComfyUI falso em {address} não subiu")
+                time.sleep(0.1)
+    return servers
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        mix += [kind.strip()] * int(weight or 1)
+    unknown = set(mix) - {'gerar', 'variacao', 'upscale'}
+    if unknown:
+        raise SystemExit(f"Tipos desconhecidos em --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+async def monitor_loop_lag(samples, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+async def run(args, imageGen):
+    mix = parse_mix(args.mix)
+    status_updates = 0
+
+    async def on_status(text):
+        nonlocal status_updates
+        status_updates += 1
+
+    async def run_job(kind, index, source):
+        ckpt_name = CHECKPOINTS[index % args.checkpoints]
+        if kind == 'gerar':
+            return await imageGen.generate_images(PROMPT, NEGATIVE, steps=args.steps, ckpt_name=ckpt_name,
+                                                  status_callback=on_status, count=args.count)
+        if kind == 'variacao':
+            return await imageGen.generate_alternatives(source, PROMPT, NEGATIVE, steps=args.steps, ckpt_name=ckpt_name)
+        return [await imageGen.upscale_image(source, PROMPT, NEGATIVE, ckpt_name=ckpt_name, status_callback=on_status)]
+
+    # Aquecimento (fora da medição): abre as conexões e gera a imagem de entrada das variações/upscales
+    source = (await run_job('gerar', 0, None))[0]
+
+    latencies = {kind: [] for kind in ('gerar', 'variacao', 'upscale')}
+    failures = 0
+    images = 0
+    lag = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag))
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def one(index):
+        nonlocal failures, images
+        kind = mix[index % len(mix)]
+        async with limit:
+            start = time.perf_counter()
+            try:
+                result = await run_job(kind, index, source)
+            except Exception as e:
+                print(f"Job {index} ({kind}) falhou: {e}")
+                result = None
+            if not result:
+                failures += 1
+                return
+            latencies[kind].append(time.perf_counter() - start)
+            images += len(result)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(args.jobs)))
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+
+    done = sum(len(values) for values in latencies.values())
+    print(f"{args.jobs} jobs, {args.concurrency} em paralelo, {args.servers} servidor(es), speed {args.speed}: "
+          f"{elapsed:.2f} s")
+    print(f"vazão: {done / elapsed:.2f} jobs/s, {images / elapsed:.2f} imagens/s, {failures} falhas, "
+          f"{status_updates} avisos de status")
+    print(f"{'tipo':10} {'jobs':>6} {'p50 ms':>9} {'p99 ms':>9} {'máx ms':>9}")
+    for kind, values in [*latencies.items(), ('todos', [v for values in latencies.values() for v in values])]:
+        if values:
+            print(f"{kind:10} {len(values):6} {percentile(values, 50) * 1000:9.1f} {percentile(values, 99) * 1000:9.1f} "
+                  f"{max(values) * 1000:9.1f}")
+    print(f"event loop: atraso p50 {percentile(lag, 50) * 1000:.2f} ms, p99 {percentile(lag, 99) * 1000:.2f} ms, "
+          f"máx {max(lag, default=0) * 1000:.2f} ms ({len(lag)} amostras)")
+    await imageGen.get_comfy_pool().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta do imageGen contra o ComfyUI falso")
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--speed', type=float, default=0.01, help="velocidade do servidor falso (0 = instantâneo)")
+    parser.add_argument('--servers', type=int, default=1, help="quantos ComfyUI falsos no pool")
+    parser.add_argument('--mix', default='gerar=6,variacao=2,upscale=1', help="peso de cada tipo de job")
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--count', type=int, default=None, help="imagens por /gerar (padrão do workflow: 4)")
+    parser.add_argument('--checkpoints', type=int, default=2, choices=(1, 2), help="checkpoints alternados entre os jobs")
+    parser.add_argument('--max-side', type=int, default=1024, help="maior lado das imagens do servidor falso")
+    parser.add_argument('--websocket-outputs', action='store_true', help="imagens finais pelo websocket")
+    args = parser.parse_args()
+
+    servers = start_servers(args.servers, args)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # O imageGen lê o config.properties da pasta atual ao ser importado
+            with open(os.path.join(workdir, 'config.properties'), 'w', encoding='utf-8') as file:
+                file.write(CONFIG_TEMPLATE.format(servers=', '.join(address for address, _ in servers),
+                                                  websocket_outputs=str(args.websocket_outputs).lower()))
+            os.chdir(workdir)
+            import imageGen
+            asyncio.run(run(args, imageGen))
+            os.chdir(ROOT)
+        for address, _ in servers:
+            stats = json.loads(urllib.request.urlopen(f'http://{address}/fake/stats', timeout=5).read())
+            print(f"servidor {address}: {stats}")
+    finally:
+        for _, process in servers:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Micro-benchmark: custo de montar o workflow de um job, antes e depois dos templates.
+
+Antes: abre e parseia o JSON do disco e re-separa/adivinha os *_NODES a cada job.
+Depois: template carregado uma vez, cópia rasa + patch com os planos já resolvidos.
+
+Uso (na raiz do repositório):
+    python benchmarks/bench_workflow_build.py [iterações]
+"""
+import configparser
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from workflowTemplates import WorkflowTemplate
+
+# Seção parecida com a do config.properties real, usando o workflow PLUS (o maior do repo)
+SETTINGS = {
+    'CONFIG': os.path.join(ROOT, 'comfyUI-workflows', 'Full-Work_discord_BOT_PLUS.json'),
+    'PROMPT_NODES': '22',
+    'NEG_PROMPT_NODES': '110',
+    'CLIP_SKIP_NODES': '4',
+    'STEPS_NODES': '89',
+    'CFG_NODES': '91',
+    'CHECKPOINT_NODES': '158',
+    'SAMPLER_NODES': '169',
+    'RAND_SEED_NODES': '95',
+}
+
+JOB = dict(prompt="1girl, cyberpunk city, rain", negative_prompt="bad hands", steps=24, cfg=4.0,
+           sampler_name="euler_ancestral", scheduler="normal", ckpt_name="anime/novaAnimeXL_ilV140.safetensors",
+           seed=123456789)
+
+
+def set_node_values(workflow, nodes_str, field_key, value, is_string_number=False):
+    # Cópia da implementação antiga do imageGen.py, só para comparação
+    if not nodes_str or nodes_str.strip() == "":
+        return
+    node_ids = [n.strip() for n in nodes_str.split(',') if n.strip()]
+    for node_id in node_ids:
+        if node_id in workflow:
+            inputs = workflow[node_id]['inputs']
+            final_value = str(value) if is_string_number else value
+            if field_key in inputs:
+                inputs[field_key] = final_value
+            elif 'value' in inputs:
+                inputs['value'] = final_value
+            elif 'Number' in inputs:
+                inputs['Number'] = str(value)
+            elif 'text' in inputs and isinstance(value, str):
+                inputs['text'] = value
+            elif 'string_b' in inputs and isinstance(value, str):
+                inputs['string_b'] = value
+
+
+def build_before(section):
+    with open(section['CONFIG'], 'r', encoding='utf-8') as file:
+        workflow = json.load(file)
+    set_node_values(workflow, section.get('PROMPT_NODES', fallback=''), 'text', JOB['prompt'])
+    set_node_values(workflow, section.get('CLIP_SKIP_NODES', fallback=''), 'stop_at_last_layers', -2)
+    set_node_values(workflow, section.get('NEG_PROMPT_NODES', fallback=''), 'text', JOB['negative_prompt'])
+    set_node_values(workflow, section.get('STEPS_NODES', fallback=''), 'value', JOB['steps'])
+    set_node_values(workflow, section.get('CFG_NODES', fallback=''), 'Number', JOB['cfg'], is_string_number=True)
+    set_node_values(workflow, section.get('CHECKPOINT_NODES', fallback=''), 'ckpt_name', JOB['ckpt_name'])
+    for node in section.get('SAMPLER_NODES', fallback='').split(','):
+        if node.strip() in workflow:
+            workflow[node.strip()]['inputs']['sampler_name'] = JOB['sampler_name']
+            workflow[node.strip()]['inputs']['scheduler'] = JOB['scheduler']
+    set_node_values(workflow, section.get('RAND_SEED_NODES', fallback=''), 'seed', JOB['seed'])
+    return workflow
+
+
+def build_after(template):
+    job = template.new_job()
+    job.set('prompt', JOB['prompt'])
+    job.set('clip_skip', -2)
+    job.set('negative_prompt', JOB['negative_prompt'])
+    job.set('steps', JOB['steps'])
+    job.set('cfg', JOB['cfg'])
+    job.set('checkpoint', JOB['ckpt_name'])
+    job.set('sampler', JOB['sampler_name'])
+    job.set('scheduler', JOB['scheduler'])
+    job.set('seed', JOB['seed'])
+    return job.workflow
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read_dict({'BENCH': SETTINGS})
+    section = config['BENCH']
+    template = WorkflowTemplate('BENCH', section)
+
+    # Os dois caminhos precisam gerar exatamente o mesmo workflow
+    assert build_before(section) == build_after(template), "workflow diferente entre antes e depois"
+    # E o template não pode ter sido alterado pelo job
+    assert template.workflow == WorkflowTemplate('BENCH', section).workflow, "job alterou o template"
+
+    before = min(timeit.repeat(lambda: build_before(section), number=iterations, repeat=5)) / iterations
+    after = min(timeit.repeat(lambda: build_after(template), number=iterations, repeat=5)) / iterations
+
+    print(f"workflow: {os.path.basename(SETTINGS['CONFIG'])} ({len(template.workflow)} nós)")
+    print(f"antes  (disco + json.load + set_node_values): {before * 1e6:8.1f} µs/job")
+    print(f"depois (template + copy-and-patch):           {after * 1e6:8.1f} µs/job")
+    print(f"ganho: {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
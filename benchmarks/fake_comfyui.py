@@ -0,0 +1,528 @@
+"""
+ComfyUI falso, para rodar o imageGen (e o bot) sem GPU.
+
+Implementa a parte da API que o bot usa: /prompt, /queue, /history/{id}, /view,
+/upload/image, /interrupt, /system_stats e /ws. Os prompts rodam um de cada vez, como
+numa GPU só, com os nós em ordem topológica: cada nó manda 'executing', os samplers mandam
+'progress' a cada passo, e os nós de salvar geram PNGs de verdade, do tamanho do latent
+(ou da imagem de entrada, vezes o upscale_by), servidos pelo /view.
+Como no ComfyUI, nós com as mesmas entradas do prompt anterior não rodam de novo e vêm
+em 'execution_cached' (ex: o checkpoint só é "carregado" quando muda).
+
+Tempos: NODE_DELAYS (segundos por nó) e STEP_NODES (segundos por passo, por imagem do
+batch), todos multiplicados por --speed (0 = instantâneo). --delay CLASSE=SEGUNDOS troca o
+tempo de uma classe (por passo, se for um sampler).
+
+Uso (na raiz do repositório):
+    python benchmarks/fake_comfyui.py [--port 8188] [--speed 1] [--delay KSampler=0.05] [--previews]
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+# Segundos por nó com --speed 1, perto de SDXL numa GPU de consumo
+NODE_DELAYS = {
+    'CheckpointLoaderSimple': 3.0,
+    'Checkpoint Loader (Simple)': 3.0,
+    'UpscaleModelLoader': 0.5,
+    'UltralyticsDetectorProvider': 0.3,
+    'Power Lora Loader (rgthree)': 0.5,
+    'CLIPTextEncode': 0.05,
+    'VAEEncode': 0.2,
+    'VAEEncodeTiled': 0.3,
+    'VAEDecode': 0.4,
+    'VAEDecodeTiled': 0.6,
+    'SaveImage': 0.1,
+    'Image Save': 0.15,
+    'PreviewImage': 0.05,
+    'SaveImageWebsocket': 0.05,
+}
+# Nós de texto, números e afins
+DEFAULT_NODE_DELAY = 0.002
+# Nós que mandam 'progress': segundos por passo, por imagem do batch
+STEP_NODES = {'KSampler': 0.12, 'KSamplerAdvanced': 0.12, 'FaceDetailer': 0.08, 'UltimateSDUpscale': 0.25}
+DEFAULT_STEPS = 20
+# Nó de salvar -> tipo da pasta das imagens
+SAVE_NODES = {'SaveImage': 'output', 'Image Save': 'output', 'PreviewImage': 'temp'}
+WEBSOCKET_SAVE_NODE = 'SaveImageWebsocket'
+
+# Frames binários do websocket: [tipo do evento][formato da imagem][imagem]
+PREVIEW_IMAGE = 1
+JPEG_FORMAT = 1
+PNG_FORMAT = 2
+
+
+def topological_order(prompt):
+    """Nós na ordem de execução: cada um depois dos nós que alimentam suas entradas."""
+    order = []
+    state = {}
+
+    def visit(node_id):
+        if state.get(node_id) == 'done':
+            return
+        if state.get(node_id) == 'visiting':
+            raise ValueError(f"Ciclo no workflow no nó {node_id}")
+        state[node_id] = 'visiting'
+        for value in prompt[node_id].get('inputs', {}).values():
+            if is_link(value) and value[0] in prompt:
+                visit(value[0])
+        state[node_id] = 'done'
+        order.append(node_id)
+
+    for node_id in prompt:
+        visit(node_id)
+    return order
+
+
+def is_link(value):
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+
+
+def node_signatures(prompt, order):
+    """Assinatura de cada nó (classe, entradas e assinatura de quem o alimenta), como a chave do cache do ComfyUI."""
+    signatures = {}
+    for node_id in order:
+        node = prompt[node_id]
+        inputs = {
+            key: ('link', signatures.get(value[0]), value[1]) if is_link(value) else value
+            for key, value in node.get('inputs', {}).items()
+        }
+        signatures[node_id] = json.dumps([node['class_type'], inputs], sort_keys=True, default=str)
+    return signatures
+
+
+def parse_annotated_name(name):
+    """"sub/arquivo.png [output]" -> ('output', 'sub', 'arquivo.png'); sem anotação a pasta é input."""
+    folder_type = 'input'
+    for suffix in ('input', 'output', 'temp'):
+        if name.endswith(f' [{suffix}]'):
+            name, folder_type = name[:-len(suffix) - 3], suffix
+            break
+    subfolder, _, filename = name.rpartition('/')
+    return folder_type, subfolder, filename
+
+
+def tag_png(png, text):
+    """
+    Põe um chunk tEXt logo depois do IHDR: cada arquivo fica único (hash diferente)
+    sem recodificar a imagem.
+    """
+    data = b'fake\x00' + text.encode()
+    chunk = struct.pack('>I', len(data)) + b'tEXt' + data + struct.pack('>I', zlib.crc32(b'tEXt' + data))
+    return png[:33] + chunk + png[33:]
+
+
+def int_input(inputs, key, default):
+    value = inputs.get(key)
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0 else default
+
+
+class FakeComfyUI:
+    def __init__(self, speed=1.0, delays=None, previews=False, error_rate=0.0, max_side=2048, max_files=500,
+                 max_history=1000, seed=None):
+        self.speed = speed
+        self.delays = {**NODE_DELAYS, **STEP_NODES, **(delays or {})}
+        self.previews = previews
+        self.error_rate = error_rate
+        self.max_side = max_side
+        self.max_files = max_files
+        self.max_history = max_history
+        self.rng = random.Random(seed)
+        self.queue = []                   # [(número, prompt_id, prompt, client_id)]
+        self.running = None
+        self.number = 0
+        self.history = OrderedDict()      # prompt_id -> entrada do /history
+        self.files = OrderedDict()        # (tipo, subpasta, nome) -> bytes
+        self.sockets = {}                 # client_id -> websockets abertos
+        self.cache = {}                   # node_id -> (assinatura, saída) do último prompt que rodou o nó
+        self.interrupt_requested = False
+        self.image_counter = 0
+        self.base_pngs = {}               # (largura, altura) -> PNG base
+        self.preview_frame = None
+        self.stats = {'prompts': 0, 'completed': 0, 'failed': 0, 'interrupted': 0, 'deleted': 0,
+                      'uploads': 0, 'views': 0, 'cached_nodes': 0}
+        self._wakeup = None
+        self._worker_task = None
+
+    # --- APP ---
+    def make_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([
+            web.post('/prompt', self.post_prompt),
+            web.get('/queue', self.get_queue),
+            web.post('/queue', self.post_queue),
+            web.get('/history', self.get_history),
+            web.get('/history/{prompt_id}', self.get_history),
+            web.get('/view', self.get_view),
+            web.post('/upload/image', self.post_upload),
+            web.post('/interrupt', self.post_interrupt),
+            web.get('/system_stats', self.get_system_stats),
+            web.get('/fake/stats', self.get_fake_stats),
+            web.get('/ws', self.websocket),
+        ])
+        app.on_startup.append(self._start_worker)
+        app.on_cleanup.append(self._stop_worker)
+        return app
+
+    async def _start_worker(self, app):
+        self._wakeup = asyncio.Event()
+        self._worker_task = asyncio.create_task(self._worker())
+
+    async def _stop_worker(self, app):
+        self._worker_task.cancel()
+        await asyncio.gather(self._worker_task, return_exceptions=True)
+
+    # --- REST ---
+    async def post_prompt(self, request):
+        body = await request.json()
+        prompt = body.get('prompt')
+        if not isinstance(prompt, dict) or not prompt:
+            return web.json_response({'error': {'type': 'invalid_prompt', 'message': 'Invalid prompt', 'details': '',
+                                                'extra_info': {}}, 'node_errors': {}}, status=400)
+        try:
+            topological_order(prompt)
+        except (ValueError, KeyError, TypeError) as e:
+            return web.json_response({'error': {'type': 'invalid_prompt', 'message': str(e), 'details': '',
+                                                'extra_info': {}}, 'node_errors': {}}, status=400)
+        node_errors = self._validate(prompt)
+        if node_errors:
+            return web.json_response({'error': {'type': 'prompt_outputs_failed_validation',
+                                                'message': 'Prompt outputs failed validation', 'details': '',
+                                                'extra_info': {}}, 'node_errors': node_errors}, status=400)
+
+        self.number += 1
+        prompt_id = str(uuid.uuid4())
+        self.queue.append((self.number, prompt_id, prompt, body.get('client_id')))
+        self.stats['prompts'] += 1
+        self._wakeup.set()
+        await self._broadcast_status()
+        return web.json_response({'prompt_id': prompt_id, 'number': self.number, 'node_errors': {}})
+
+    def _validate(self, prompt):
+        """Só o que dá para errar de verdade no bot: LoadImage apontando para um arquivo que não existe."""
+        node_errors = {}
+        for node_id, node in prompt.items():
+            if node.get('class_type') != 'LoadImage':
+                continue
+            name = node.get('inputs', {}).get('image')
+            if isinstance(name, str) and parse_annotated_name(name) in self.files:
+                continue
+            node_errors[node_id] = {
+                'errors': [{'type': 'custom_validation_failed', 'message': 'Custom validation failed for node',
+                            'details': f'image - Invalid image file: {name}', 'extra_info': {}}],
+                'dependent_outputs': [],
+                'class_type': 'LoadImage',
+            }
+        return node_errors
+
+    async def get_queue(self, request):
+        running = [[self.running[0], self.running[1], self.running[2], {}, []]] if self.running else []
+        pending = [[number, prompt_id, prompt, {}, []] for number, prompt_id, prompt, _ in self.queue]
+        return web.json_response({'queue_running': running, 'queue_pending': pending})
+
+    async def post_queue(self, request):
+        body = await request.json()
+        if body.get('clear'):
+            self.stats['deleted'] += len(self.queue)
+            self.queue.clear()
+        delete = set(body.get('delete') or ())
+        if delete:
+            before = len(self.queue)
+            self.queue = [item for item in self.queue if item[1] not in delete]
+            self.stats['deleted'] += before - len(self.queue)
+        await self._broadcast_status()
+        return web.Response()
+
+    async def post_interrupt(self, request):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        target = (body or {}).get('prompt_id')
+        # Com prompt_id, só interrompe se for ele que está rodando (versões novas do ComfyUI)
+        if self.running and (target is None or target == self.running[1]):
+            self.interrupt_requested = True
+        return web.Response()
+
+    async def get_history(self, request):
+        prompt_id = request.match_info.get('prompt_id')
+        if prompt_id is None:
+            return web.json_response(dict(self.history))
+        entry = self.history.get(prompt_id)
+        return web.json_response({prompt_id: entry} if entry is not None else {})
+
+    async def get_view(self, request):
+        key = (request.query.get('type') or 'output', request.query.get('subfolder', ''), request.query.get('filename', ''))
+        data = self.files.get(key)
+        if data is None:
+            raise web.HTTPNotFound()
+        self.stats['views'] += 1
+        return web.Response(body=data, content_type='image/png')
+
+    async def post_upload(self, request):
+        form = await request.post()
+        field = form.get('image')
+        if field is None or not hasattr(field, 'file'):
+            raise web.HTTPBadRequest()
+        folder_type = form.get('type') or 'input'
+        subfolder = form.get('subfolder') or ''
+        filename = field.filename
+        if form.get('overwrite') != 'true':
+            stem, dot, extension = filename.rpartition('.')
+            counter = 1
+            while (folder_type, subfolder, filename) in self.files:
+                filename = f"{stem} ({counter}){dot}{extension}"
+                counter += 1
+        self._store((folder_type, subfolder, filename), field.file.read())
+        self.stats['uploads'] += 1
+        return web.json_response({'name': filename, 'subfolder': subfolder, 'type': folder_type})
+
+    async def get_system_stats(self, request):
+        return web.json_response({
+            'system': {'os': 'fake', 'comfyui_version': 'fake', 'python_version': '', 'embedded_python': False},
+            'devices': [{'name': 'fake', 'type': 'cuda', 'index': 0, 'vram_total': 24 << 30, 'vram_free': 20 << 30,
+                         'torch_vram_total': 0, 'torch_vram_free': 0}],
+        })
+
+    async def get_fake_stats(self, request):
+        return web.json_response({**self.stats, 'queue': len(self.queue), 'files': len(self.files),
+                                  'history': len(self.history), 'clients': sum(map(len, self.sockets.values()))})
+
+    # --- WEBSOCKET ---
+    async def websocket(self, request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        client_id = request.query.get('clientId') or uuid.uuid4().hex
+        self.sockets.setdefault(client_id, set()).add(ws)
+        try:
+            await ws.send_str(json.dumps({'type': 'status', 'data': {'status': self._status(), 'sid': client_id}}))
+            async for _ in ws:
+                pass
+        finally:
+            self.sockets[client_id].discard(ws)
+            if not self.sockets[client_id]:
+                del self.sockets[client_id]
+        return ws
+
+    def _status(self):
+        return {'exec_info': {'queue_remaining': len(self.queue) + (1 if self.running else 0)}}
+
+    async def _send(self, client_id, message):
+        data = message if isinstance(message, bytes) else json.dumps(message)
+        for ws in list(self.sockets.get(client_id, ())):
+            try:
+                if isinstance(data, bytes):
+                    await ws.send_bytes(data)
+                else:
+                    await ws.send_str(data)
+            except (ConnectionResetError, RuntimeError):
+                pass
+
+    async def _broadcast_status(self):
+        message = {'type': 'status', 'data': {'status': self._status()}}
+        for client_id in list(self.sockets):
+            await self._send(client_id, message)
+
+    # --- EXECUÇÃO ---
+    async def _worker(self):
+        while True:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self.running = self.queue.pop(0)
+            try:
+                await self._execute(*self.running)
+            finally:
+                self.running = None
+                self.interrupt_requested = False
+                await self._broadcast_status()
+
+    async def _sleep(self, seconds):
+        await asyncio.sleep(max(0.0, seconds * self.speed))
+
+    async def _execute(self, number, prompt_id, prompt, client_id):
+        async def send(message):
+            await self._send(client_id, message)
+
+        def timestamp():
+            return int(time.time() * 1000)
+
+        await send({'type': 'execution_start', 'data': {'prompt_id': prompt_id, 'timestamp': timestamp()}})
+        order = topological_order(prompt)
+        signatures = node_signatures(prompt, order)
+        cached = [node_id for node_id in order if self.cache.get(node_id, (None,))[0] == signatures[node_id]]
+        self.stats['cached_nodes'] += len(cached)
+        await send({'type': 'execution_cached', 'data': {'nodes': cached, 'prompt_id': prompt_id, 'timestamp': timestamp()}})
+
+        batch, width, height = self._image_shape(prompt)
+        cached = set(cached)
+        outputs = {}
+        executed = []
+        for node_id in order:
+            node = prompt[node_id]
+            class_type = node['class_type']
+            if node_id in cached:
+                output = self.cache[node_id][1]
+                if output:
+                    outputs[node_id] = output
+                continue
+
+            await send({'type': 'executing', 'data': {'node': node_id, 'display_node': node_id, 'prompt_id': prompt_id}})
+            if class_type in STEP_NODES:
+                if self.error_rate and self.rng.random() < self.error_rate:
+                    await self._fail(send, prompt_id, number, prompt, node_id, class_type, executed)
+                    return
+                await self._run_steps(send, prompt_id, node_id, node, batch)
+            else:
+                await self._sleep(self.delays.get(class_type, DEFAULT_NODE_DELAY))
+
+            if self.interrupt_requested:
+                self.stats['interrupted'] += 1
+                await send({'type': 'execution_interrupted', 'data': {
+                    'prompt_id': prompt_id, 'node_id': node_id, 'node_type': class_type, 'executed': executed}})
+                self._record(prompt_id, number, prompt, outputs, 'error', [['execution_interrupted', {'prompt_id': prompt_id}]])
+                return
+
+            output = None
+            if class_type in SAVE_NODES:
+                output = {'images': [self._save_image(node, SAVE_NODES[class_type], width, height) for _ in range(batch)]}
+                outputs[node_id] = output
+                await send({'type': 'executed', 'data': {'node': node_id, 'display_node': node_id, 'output': output,
+                                                         'prompt_id': prompt_id}})
+            elif class_type == WEBSOCKET_SAVE_NODE:
+                for _ in range(batch):
+                    await send(struct.pack('>II', PREVIEW_IMAGE, PNG_FORMAT) + self._png(width, height))
+            self.cache[node_id] = (signatures[node_id], output)
+            executed.append(node_id)
+
+        self.stats['completed'] += 1
+        self._record(prompt_id, number, prompt, outputs, 'success', [['execution_success', {'prompt_id': prompt_id}]])
+        await send({'type': 'execution_success', 'data': {'prompt_id': prompt_id, 'timestamp': timestamp()}})
+        await send({'type': 'executing', 'data': {'node': None, 'prompt_id': prompt_id}})
+
+    async def _run_steps(self, send, prompt_id, node_id, node, batch):
+        steps = int(int_input(node['inputs'], 'steps', DEFAULT_STEPS))
+        step_delay = self.delays[node['class_type']] * batch
+        for step in range(1, steps + 1):
+            await self._sleep(step_delay)
+            if self.interrupt_requested:
+                return
+            await send({'type': 'progress', 'data': {'value': step, 'max': steps, 'prompt_id': prompt_id, 'node': node_id}})
+            if self.previews:
+                await send(self._preview())
+
+    async def _fail(self, send, prompt_id, number, prompt, node_id, class_type, executed):
+        self.stats['failed'] += 1
+        error = {'prompt_id': prompt_id, 'node_id': node_id, 'node_type': class_type, 'executed': executed,
+                 'exception_message': 'Allocation on device\n', 'exception_type': 'torch.OutOfMemoryError',
+                 'traceback': [], 'current_inputs': {}, 'current_outputs': {}}
+        await send({'type': 'execution_error', 'data': error})
+        self._record(prompt_id, number, prompt, {}, 'error', [['execution_error', error]])
+
+    def _record(self, prompt_id, number, prompt, outputs, status, messages):
+        self.history[prompt_id] = {
+            'prompt': [number, prompt_id, prompt, {}, list(outputs)],
+            'outputs': outputs,
+            'status': {'status_str': status, 'completed': status == 'success', 'messages': messages},
+            'meta': {node_id: {'node_id': node_id, 'display_node': node_id} for node_id in outputs},
+        }
+        while len(self.history) > self.max_history:
+            self.history.popitem(last=False)
+
+    # --- IMAGENS ---
+    def _image_shape(self, prompt):
+        """(batch, largura, altura) das imagens de saída do prompt."""
+        batch, width, height, scale = 1, None, None, 1.0
+        for node in prompt.values():
+            inputs = node.get('inputs', {})
+            class_type = node['class_type']
+            if class_type == 'EmptyLatentImage':
+                batch = int(int_input(inputs, 'batch_size', batch))
+                width = int(int_input(inputs, 'width', 1024))
+                height = int(int_input(inputs, 'height', 1024))
+            elif class_type == 'RepeatLatentBatch':
+                batch = int(int_input(inputs, 'amount', batch))
+            elif class_type == 'UltimateSDUpscale':
+                scale = int_input(inputs, 'upscale_by', 2.0)
+            elif class_type == 'LoadImage' and width is None:
+                data = self.files.get(parse_annotated_name(inputs.get('image', '')))
+                if data is not None:
+                    with Image.open(BytesIO(data)) as image:
+                        width, height = image.size
+        width, height = (width or 1024) * scale, (height or 1024) * scale
+        shrink = min(1.0, self.max_side / max(width, height))
+        return batch, max(8, int(width * shrink)), max(8, int(height * shrink))
+
+    def _png(self, width, height):
+        base = self.base_pngs.get((width, height))
+        if base is None:
+            # Gradiente com ruído: o PNG fica com tamanho parecido com o de uma imagem gerada
+            image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+            noise = Image.effect_noise((width, height), 32).convert('RGB')
+            buffer = BytesIO()
+            Image.blend(image, noise, 0.2).save(buffer, format='PNG', compress_level=1)
+            base = self.base_pngs[(width, height)] = buffer.getvalue()
+        self.image_counter += 1
+        return tag_png(base, str(self.image_counter))
+
+    def _preview(self):
+        if self.preview_frame is None:
+            buffer = BytesIO()
+            Image.new('RGB', (128, 128), (90, 90, 90)).save(buffer, format='JPEG')
+            self.preview_frame = struct.pack('>II', PREVIEW_IMAGE, JPEG_FORMAT) + buffer.getvalue()
+        return self.preview_frame
+
+    def _save_image(self, node, folder_type, width, height):
+        prefix = node['inputs'].get('filename_prefix')
+        prefix = prefix if isinstance(prefix, str) and prefix else 'ComfyUI'
+        subfolder, _, prefix = prefix.rpartition('/')
+        filename = f"{prefix}_{self.image_counter + 1:05}_.png"
+        self._store((folder_type, subfolder, filename), self._png(width, height))
+        return {'filename': filename, 'subfolder': subfolder, 'type': folder_type}
+
+    def _store(self, key, data):
+        self.files[key] = data
+        self.files.move_to_end(key)
+        while len(self.files) > self.max_files:
+            self.files.popitem(last=False)
+
+
+def parse_delay(value):
+    class_type, _, seconds = value.rpartition('=')
+    if not class_type:
+        raise argparse.ArgumentTypeError(f"use CLASSE=SEGUNDOS, não {value!r}")
+    return class_type, float(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ComfyUI falso para testes e benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8188)
+    parser.add_argument('--speed', type=float, default=1.0, help="multiplica todos os tempos (0 = instantâneo)")
+    parser.add_argument('--delay', type=parse_delay, action='append', default=[], metavar='CLASSE=SEGUNDOS',
+                        help="tempo de uma classe de nó (por passo, nos samplers)")
+    parser.add_argument('--previews', action='store_true', help="manda um preview JPEG a cada passo")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fração dos prompts que falham no sampler")
+    parser.add_argument('--max-side', type=int, default=2048, help="maior lado das imagens geradas")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeComfyUI(speed=args.speed, delays=dict(args.delay), previews=args.previews,
+                         error_rate=args.error_rate, max_side=args.max_side, seed=args.seed)
+    print(f"ComfyUI falso em http://{args.host}:{args.port} (speed {args.speed})", flush=True)
+    web.run_app(server.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
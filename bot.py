@@ -2,10 +2,20 @@ import discord
 import discord.ext
 from discord import app_commands
 import configparser
+import asyncio
+import functools
+import multiprocessing
 import os
-from PIL import Image
-from datetime import datetime
-from math import ceil, sqrt
+from contextlib import asynccontextmanager
+from io import BytesIO
+from statusUpdates import StatusCoalescer
+from outputStore import OutputStore
+from collage import build_collage_from_bytes
+from imageExecutor import ImageExecutor
+from jobScheduler import FairScheduler
+from singleFlight import SingleFlight, RequestBatcher
+import metrics
+import jobTrace
 
 # --- CARREGAMENTO DE CONFIGURAÇÃO ---
 def load_config():
@@ -79,48 +89,216 @@ SCHEDULER_CHOICES = [
     app_commands.Choice(name="Simple", value="simple"),
 ]
 
+# --- PASTA DE SAÍDA ---
+# Arquivos por hash do conteúdo (sem duplicatas nem colisões), com limite de tamanho e idade
+output_store = OutputStore(
+    root=config.get('BOT', 'OUTPUT_DIR', fallback='./out'),
+    max_bytes=int(config.getfloat('BOT', 'OUTPUT_MAX_MB', fallback=2048) * 1024 * 1024),
+    max_age=config.getfloat('BOT', 'OUTPUT_MAX_AGE_DAYS', fallback=14) * 86400,
+)
+
+# --- COLAGEM ---
+# Formato da prévia (png rápido, webp ou jpeg) e maior lado em pixels (0 = tamanho original)
+COLLAGE_FORMAT = config.get('BOT', 'COLLAGE_FORMAT', fallback='png').lower()
+COLLAGE_MAX_SIDE = config.getint('BOT', 'COLLAGE_MAX_SIDE', fallback=0)
+COLLAGE_QUALITY = config.getint('BOT', 'COLLAGE_QUALITY', fallback=85)
+
+# Trabalho de CPU com imagens roda fora do processo do bot (heartbeat do gateway não atrasa)
+image_executor = ImageExecutor(
+    workers=config.getint('BOT', 'IMAGE_WORKERS', fallback=0) or None,
+    use_processes=config.get('BOT', 'IMAGE_EXECUTOR', fallback='process').lower() != 'thread',
+)
+
 # --- FUNÇÕES AUXILIARES ---
 
-def create_collage(images):
-    if not images or len(images) == 0:
+async def criar_colagem(images):
+    """Monta a colagem no executor de imagens, em memória, e devolve o discord.File pronto."""
+    if not images:
         return None
 
-    num_images = len(images)
-    num_cols = ceil(sqrt(num_images))
-    num_rows = ceil(num_images / num_cols)
-    if num_cols == 0: num_cols = 1
-    
-    collage_width = max(image.width for image in images) * num_cols
-    collage_height = max(image.height for image in images) * num_rows
-    collage = Image.new('RGB', (collage_width, collage_height))
-
-    for idx, image in enumerate(images):
-        row = idx // num_cols
-        col = idx % num_cols
-        x_offset = col * image.width
-        y_offset = row * image.height
-        collage.paste(image, (x_offset, y_offset))
-
-    if not os.path.exists('./out'):
-        os.makedirs('./out')
-
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    collage_path = f"./out/collage_{timestamp}.png"
-    collage.save(collage_path)
-    return collage_path
+    # Só os bytes vão para o pool; o índice da pasta de saída fica neste processo
+    with metrics.timed('collage'), jobTrace.span('collage'):
+        data, extension = await image_executor.run(
+            build_collage_from_bytes, [image.data for image in images], COLLAGE_MAX_SIDE, COLLAGE_FORMAT, COLLAGE_QUALITY)
+    await asyncio.to_thread(output_store.put, data, extension, 'collage')
+    return discord.File(fp=BytesIO(data), filename=f'collage{extension}')
 
-def preparar_arquivos_separados(images):
+async def preparar_arquivos_separados(images):
     # Função auxiliar caso precise debuggar arquivos individuais
     arquivos_para_envio = []
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    if not os.path.exists('./out'):
-        os.makedirs('./out')
     for idx, image in enumerate(images):
-        caminho_imagem = f"./out/img_{timestamp}_{idx}.png"
-        image.save(caminho_imagem)
-        arquivos_para_envio.append(discord.File(fp=caminho_imagem, filename=f'imagem_{idx}.png'))
+        await asyncio.to_thread(output_store.put, image.data, image.extension, 'img')
+        arquivos_para_envio.append(discord.File(fp=image.open(), filename=f'imagem_{idx}{image.extension}'))
     return arquivos_para_envio
 
+# --- STATUS DE PROGRESSO ---
+# Todas as edições "> status..." passam por aqui: só a mais recente de cada mensagem é enviada,
+# no máximo uma a cada STATUS_MIN_INTERVAL s por mensagem e STATUS_MAX_EDITS_PER_SECOND no total.
+status_updates = StatusCoalescer(
+    min_interval=config.getfloat('BOT', 'STATUS_MIN_INTERVAL', fallback=1.0),
+    max_per_second=config.getfloat('BOT', 'STATUS_MAX_EDITS_PER_SECOND', fallback=4.0),
+)
+status_updates.watch_rate_limits()
+
+def criar_status_callback(interaction, status_msg):
+    """Callback passado ao imageGen: só agenda a edição, quem envia é o StatusCoalescer."""
+    async def edit(text):
+        await interaction.edit_original_response(content=text)
+
+    async def update_discord_status(status_text):
+        status_updates.update(interaction.id, f"{status_msg}\n> {status_text}...", edit)
+    return update_discord_status
+
+# Fila local antes do ComfyUI: ninguém enterra os outros com Re-roll/U1-U4
+job_scheduler = FairScheduler(
+    max_in_flight=config.getint('BOT', 'JOBS_MAX_IN_FLIGHT', fallback=2),
+    max_per_user=config.getint('BOT', 'JOBS_PER_USER', fallback=1),
+    max_per_guild=config.getint('BOT', 'JOBS_PER_GUILD', fallback=3),
+    expensive_kinds=('upscale', 'genplus'),
+    expensive_cost=config.getint('BOT', 'JOBS_EXPENSIVE_COST', fallback=3),
+    cheap_burst=config.getint('BOT', 'JOBS_CHEAP_BURST', fallback=4),
+)
+
+@asynccontextmanager
+async def fila_do_bot(interaction, kind, update_discord_status):
+    """Vaga no agendador local para o job; enquanto espera, a posição aparece no status."""
+    async def on_position(position):
+        await update_discord_status(f"⏳ Aguardando vez no bot: Posição {position}")
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    async with job_scheduler.slot(interaction.user.id, interaction.guild_id, kind, on_position=on_position):
+        metrics.observe_stage('bot_queue', loop.time() - started)
+        jobTrace.add_span('bot_queue', started, loop.time())
+        yield
+
+# --- MÉTRICAS ---
+# /metrics no formato do Prometheus, só se METRICS_PORT for definido (padrão desligado)
+METRICS_HOST = config.get('BOT', 'METRICS_HOST', fallback='127.0.0.1')
+METRICS_PORT = config.getint('BOT', 'METRICS_PORT', fallback=0)
+metrics_server = None
+
+def coletar_metricas_do_bot():
+    status = status_updates.stats()
+    fila = job_scheduler.stats()
+    return [
+        ('sdxlbot_discord_rate_limited_total', 'counter', 'Respostas 429 do Discord (avisos de rate limit do discord.http)', status['rate_limited']),
+        ('sdxlbot_discord_status_edits_total', 'counter', 'Edições de status enviadas ao Discord', status['sent']),
+        ('sdxlbot_jobs_running', 'gauge', 'Jobs com vaga no agendador do bot', fila['running']),
+        ('sdxlbot_jobs_waiting', 'gauge', 'Jobs esperando vaga no agendador do bot', fila['waiting']),
+        ('sdxlbot_image_executor_pending', 'gauge', 'Tarefas de imagem enviadas e ainda não terminadas', image_executor.pending),
+    ]
+
+metrics.REGISTRY.add_collector(coletar_metricas_do_bot)
+
+# --- TRACE POR JOB ---
+# Uma linha JSON por job (trace_id, parâmetros e spans com tempo) em TRACE_LOG, gravada numa thread
+TRACE_LOG = config.get('BOT', 'TRACE_LOG', fallback='')
+if TRACE_LOG:
+    jobTrace.configure(
+        TRACE_LOG,
+        max_bytes=int(config.getfloat('BOT', 'TRACE_LOG_MAX_MB', fallback=10) * 1024 * 1024),
+        backup_count=config.getint('BOT', 'TRACE_LOG_BACKUPS', fallback=5),
+    )
+
+def rastrear_job(comando):
+    """Abre o trace do job quando a interação chega e grava o registro quando o handler termina."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            interaction = next(arg for arg in args if isinstance(arg, discord.Interaction))
+            recebido_ha = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+            with jobTrace.job(comando, max(0.0, recebido_ha), user_id=interaction.user.id, guild_id=interaction.guild_id):
+                return await handler(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- CANCELAMENTO ---
+# Token de interação do Discord vale 15 min: depois disso o resultado não tem onde ser entregue
+INTERACTION_TTL = 15 * 60 - 30
+
+class JobCancelado(Exception):
+    """O job foi cancelado pelo botão ou a interação expirou (a mensagem já foi tratada)."""
+
+class CancelarView(discord.ui.View):
+    """Botão "Cancelar" da mensagem de status: só quem pediu o job pode usar."""
+    def __init__(self, owner_id, task):
+        super().__init__(timeout=None)
+        self.owner_id = owner_id
+        self.task = task
+        self.motivo = None
+
+    def cancelar(self, motivo):
+        if not self.task.done():
+            self.motivo = motivo
+            self.task.cancel()
+
+    @discord.ui.button(label="Cancelar", style=discord.ButtonStyle.red, emoji="✖️")
+    async def cancelar_button(self, interaction, button):
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("Só quem pediu pode cancelar.", ephemeral=True)
+            return
+        if self.task.done():
+            await interaction.response.send_message("Esse job já terminou.", ephemeral=True)
+            return
+        self.cancelar('botao')
+        await interaction.response.defer()
+
+async def rodar_cancelavel(interaction, status_msg, coro, comando, checkpoint=None, expira=False):
+    """
+    Roda a geração numa task própria, com botão Cancelar na mensagem de status.
+    Cancelar tira o job da fila (do bot e do ComfyUI) ou interrompe a GPU, e libera a vaga na hora.
+    expira=True: o resultado é entregue pela própria interação, então o job é cancelado
+    quando o token dela vencer.
+    comando e checkpoint rotulam as métricas do job (a task herda o contexto).
+    """
+    metrics.JOB_CONTEXT.set({'command': comando, 'checkpoint': checkpoint})
+    started = asyncio.get_running_loop().time()
+    result = 'error'
+    task = asyncio.create_task(coro)
+    view = CancelarView(interaction.user.id, task)
+    timer = None
+    if expira:
+        restante = INTERACTION_TTL - (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        timer = asyncio.get_running_loop().call_later(max(0, restante), view.cancelar, 'expirou')
+    try:
+        try:
+            await interaction.edit_original_response(content=status_msg, view=view)
+        except discord.HTTPException as e:
+            print(f"Erro ao mostrar status: {e}")
+        images = await task
+        result = 'ok'
+        return images
+    except asyncio.CancelledError:
+        result = 'cancelled'
+        if view.motivo is None:
+            raise  # o próprio handler foi cancelado
+        raise JobCancelado() from None
+    finally:
+        metrics.observe_stage('generation', asyncio.get_running_loop().time() - started)
+        metrics.JOBS.inc(**metrics.job_labels(result=result))
+        jobTrace.annotate(result=result)
+        if timer is not None:
+            timer.cancel()
+        view.stop()
+        await status_updates.finish(interaction.id)
+        try:
+            if view.motivo == 'botao':
+                await interaction.edit_original_response(content=f"{status_msg}\n> ❌ Cancelado.", view=None)
+            elif view.motivo == 'expirou':
+                await interaction.channel.send(f"{interaction.user.mention} ⌛ O pedido expirou antes de terminar e foi cancelado.")
+            elif task.done() and (task.cancelled() or task.exception() is not None):
+                await interaction.edit_original_response(view=None)
+        except discord.HTTPException:
+            pass
+
+# Cliques repetidos (U1 duas vezes, dois usuários no mesmo V2) esperam o mesmo job
+jobs_em_andamento = SingleFlight()
+# Re-rolls iguais que ainda estão esperando a vez viram um único prompt com batch maior
+# Acima de BUTTONS_PER_ROW imagens os botões de cada ação viram um menu, que aceita até 25 opções
+BUTTONS_PER_ROW = 5
+MAX_BATCH = min(config.getint('BOT', 'MAX_BATCH', fallback=8), 25)
+rerolls_em_espera = RequestBatcher(max_batch=MAX_BATCH)
+
 # --- SETUP DO BOT ---
 intents = discord.Intents.default() 
 client = discord.Client(intents=intents)
@@ -136,6 +314,13 @@ async def on_ready():
     await tree.sync()
     print(f'Logado como {client.user.name} ({client.user.id})')
     print(f'Carregados {len(CHECKPOINT_CHOICES)} modelos do config.')
+    global metrics_server
+    # on_ready roda de novo a cada reconexão do gateway: o servidor sobe uma vez só
+    if METRICS_PORT and metrics_server is None:
+        try:
+            metrics_server = await metrics.start_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            print(f"Não foi possível abrir o /metrics em {METRICS_HOST}:{METRICS_PORT}: {e}")
 
 # --- VIEW DE BOTÕES ---
 class Buttons(discord.ui.View):
@@ -152,39 +337,29 @@ class Buttons(discord.ui.View):
         self.scheduler = scheduler
         self.is_plus = is_plus # Sabe se veio do /gerar ou /genplus
 
-        if len(images) > 8:
-            images = images[:8]
-
-        # Row 1: Extrair Imagem Única
-        for idx, _ in enumerate(images):
-            row = 1 + (idx // 5) 
-            btn = ImageButton(f"{idx + 1}", "📩", row, self.enviar_imagem_unica)
-            self.add_item(btn)
-
-        # Row 2: Variação
-        for idx, _ in enumerate(images):
-            row = 2 + (idx // 5) 
-            btn = ImageButton(f"V{idx + 1}", "♻️", row, self.generate_alternatives_and_send)
-            self.add_item(btn)
-
-        # Row 3: Upscale
-        for idx, _ in enumerate(images):
-            row = 3 + (idx // 5)
-            if row > 4: row = 4 
-            btn = ImageButton(f"U{idx + 1}", "⬆️", row, self.upscale_and_send)
-            self.add_item(btn)
-
-    async def enviar_imagem_unica(self, interaction, button):
-        index = int(button.label) - 1 
-        await interaction.response.send_message(f"Extraindo imagem {button.label}...", ephemeral=False)
+        # Uma linha por ação (Row 1: Extrair Imagem Única, Row 2: Variação, Row 3: Upscale).
+        # O Discord aceita 5 botões por linha: com mais imagens, a linha vira um menu de seleção
+        acoes = [
+            ("", "📩", "Separar uma imagem", self.enviar_imagem_unica),
+            ("V", "♻️", "Variações de uma imagem", self.generate_alternatives_and_send),
+            ("U", "⬆️", "Upscale de uma imagem", self.upscale_and_send),
+        ]
+        for row, (prefixo, emoji, placeholder, callback) in enumerate(acoes, start=1):
+            if len(images) <= BUTTONS_PER_ROW:
+                for idx, _ in enumerate(images):
+                    self.add_item(ImageButton(f"{prefixo}{idx + 1}", emoji, row, callback, idx))
+            else:
+                self.add_item(ImageSelect(prefixo, emoji, placeholder, len(images[:25]), row, callback))
+
+    async def enviar_imagem_unica(self, interaction, index):
+        numero = index + 1
+        await interaction.response.send_message(f"Extraindo imagem {numero}...", ephemeral=False)
         image = self.images[index]
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        single_image_path = f"./out/single_{timestamp}_{index}.png"
-        image.save(single_image_path)
-        await interaction.channel.send(content=f"{interaction.user.mention} Imagem **{button.label}** separada:", file=discord.File(fp=single_image_path, filename=f'imagem_{button.label}.png'))
+        await asyncio.to_thread(output_store.put, image.data, image.extension, 'single')
+        await interaction.channel.send(content=f"{interaction.user.mention} Imagem **{numero}** separada:", file=discord.File(fp=image.open(), filename=f'imagem_{numero}{image.extension}'))
 
-    async def generate_alternatives_and_send(self, interaction, button):
-            index = int(button.label[1:]) - 1 
+    @rastrear_job('variacao')
+    async def generate_alternatives_and_send(self, interaction, index):
             # Mensagem inicial do Discord. ephemeral=False (já corrigimos para público)
             await interaction.response.send_message(f"♻️ Criando variações...", ephemeral=False)
             
@@ -193,110 +368,154 @@ class Buttons(discord.ui.View):
                 f"{interaction.user.mention} ♻️ Criando variações com **{self.ckpt_name}**...\n"
                 f"⚙️ Config: Steps: {self.steps} | CFG: {self.cfg}"
             )
-            # Edita a mensagem para servir de base para a fila/progresso
-            await interaction.edit_original_response(content=status_msg,)
-
-            async def update_discord_status(status_text):
-                # Função que será chamada pelo imageGen.py
-                await interaction.edit_original_response(content=f"{status_msg}\n> {status_text}...")
+            # Função que será chamada pelo imageGen.py
+            update_discord_status = criar_status_callback(interaction, status_msg)
             # --------------------------------------------
 
-            images = await generate_alternatives(
-                self.images[index], 
-                self.prompt, 
-                self.negative_prompt, 
-                steps=self.steps, 
-                cfg=self.cfg, 
-                sampler_name=self.sampler, 
-                scheduler=self.scheduler, 
-                ckpt_name=self.ckpt_name,
-                status_callback=update_discord_status # <-- NOVO: Passando o callback
-            )
+            async def gerar_variacoes(status_callback):
+                async with fila_do_bot(interaction, 'variacao', status_callback):
+                    return await generate_alternatives(
+                        self.images[index], 
+                        self.prompt, 
+                        self.negative_prompt, 
+                        steps=self.steps, 
+                        cfg=self.cfg, 
+                        sampler_name=self.sampler, 
+                        scheduler=self.scheduler, 
+                        ckpt_name=self.ckpt_name,
+                        status_callback=status_callback # <-- NOVO: Passando o callback
+                    )
+
+            job_key = ('variacao', self.images[index].content_hash, self.prompt, self.negative_prompt,
+                       self.steps, self.cfg, self.sampler, self.scheduler, self.ckpt_name)
+            try:
+                images = await rodar_cancelavel(interaction, status_msg, jobs_em_andamento.do(job_key, gerar_variacoes, update_discord_status),
+                                                'variacao', self.ckpt_name)
+            except JobCancelado:
+                return
+            except Exception as e:
+                await interaction.channel.send(f"{interaction.user.mention} Erro crítico no ComfyUI: {e}")
+                return
             
-            collage_path = create_collage(images)
-            await interaction.channel.send(
-                content=f"{interaction.user.mention} Variações (Steps: {self.steps} | CFG: {self.cfg}):", 
-                file=discord.File(fp=collage_path, filename='collage.png'),
-                view=Buttons(self.prompt, self.negative_prompt, images, self.ckpt_name, self.steps, self.cfg, self.sampler, self.scheduler, self.is_plus)
-            )
+            collage_file = await criar_colagem(images)
+            with metrics.timed('discord_send'), jobTrace.span('discord_send'):
+                await interaction.channel.send(
+                    content=f"{interaction.user.mention} Variações (Steps: {self.steps} | CFG: {self.cfg}):", 
+                    file=collage_file,
+                    view=Buttons(self.prompt, self.negative_prompt, images, self.ckpt_name, self.steps, self.cfg, self.sampler, self.scheduler, self.is_plus)
+                )
             await apagar_msg_carregando(interaction)
 
 
-    async def upscale_and_send(self, interaction, button):
-        index = int(button.label[1:]) - 1
+    @rastrear_job('upscale')
+    async def upscale_and_send(self, interaction, index):
         await interaction.response.send_message(f"⬆️ Preparando Upscale...", ephemeral=False)
         
         # --- PREPARAÇÃO DO STATUS BASE E CALLBACK ---
         status_msg = f"⬆️ Upscaling com **{self.ckpt_name}** (Workflow Plus)."
-        await interaction.edit_original_response(content=status_msg,)
 
-        async def update_discord_status(status_text):
-            await interaction.edit_original_response(content=f"{status_msg}\n> {status_text}...")
+        update_discord_status = criar_status_callback(interaction, status_msg)
         # --------------------------------------------
 
-        upscaled_image = await upscale_image(
-            self.images[index], 
-            self.prompt, 
-            self.negative_prompt, 
-            ckpt_name=self.ckpt_name,
-            status_callback=update_discord_status # <-- NOVO
-        )
+        async def gerar_upscale(status_callback):
+            async with fila_do_bot(interaction, 'upscale', status_callback):
+                return await upscale_image(
+                    self.images[index], 
+                    self.prompt, 
+                    self.negative_prompt, 
+                    ckpt_name=self.ckpt_name,
+                    status_callback=status_callback # <-- NOVO
+                )
+
+        job_key = ('upscale', self.images[index].content_hash, self.prompt, self.negative_prompt, self.ckpt_name)
+        try:
+            upscaled_image = await rodar_cancelavel(interaction, status_msg, jobs_em_andamento.do(job_key, gerar_upscale, update_discord_status),
+                                             'upscale', self.ckpt_name)
+        except JobCancelado:
+            return
+        except Exception as e:
+            await interaction.channel.send(f"{interaction.user.mention} Erro crítico no ComfyUI: {e}")
+            return
         
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        upscaled_image_path = f"./out/upscaledImage_{timestamp}.png"
-        upscaled_image.save(upscaled_image_path)
+        await asyncio.to_thread(output_store.put, upscaled_image.data, upscaled_image.extension, 'upscale')
         
-        await interaction.channel.send(content=f"{interaction.user.mention} Upscale pronto:", file=discord.File(fp=upscaled_image_path, filename='upscaled_image.png'))
+        with metrics.timed('discord_send'), jobTrace.span('discord_send'):
+            await interaction.channel.send(content=f"{interaction.user.mention} Upscale pronto:", file=discord.File(fp=upscaled_image.open(), filename=f'upscaled_image{upscaled_image.extension}'))
         await apagar_msg_carregando(interaction)
 
 
     @discord.ui.button(label="Re-roll", style=discord.ButtonStyle.green, emoji="🎲", row=0)
+    @rastrear_job('reroll')
     async def reroll_image(self, interaction, btn):
         await interaction.response.send_message(f"🎲 Preparando Re-roll...", ephemeral=False)
         
         if self.is_plus:
             target_function = generate_images_plus
             mode_text = "PLUS"
+            job_kind = 'genplus'
         else:
             target_function = generate_images
             mode_text = "Normal"
+            job_kind = 'gerar'
             
         # --- PREPARAÇÃO DO STATUS BASE E CALLBACK ---
         status_msg = (
             f"🎲 Re-roll {mode_text} com **{self.ckpt_name}**...\n"
             f"⚙️ Config: Steps: {self.steps} | CFG: {self.cfg}"
         )
-        await interaction.edit_original_response(content=status_msg,)
 
-        async def update_discord_status(status_text):
-            await interaction.edit_original_response(content=f"{status_msg}\n> {status_text}...")
+        update_discord_status = criar_status_callback(interaction, status_msg)
         # --------------------------------------------
 
-        images = await target_function(
-            self.prompt, 
-            self.negative_prompt, 
-            steps=self.steps, 
-            cfg=self.cfg, 
-            sampler_name=self.sampler, 
-            scheduler=self.scheduler, 
-            ckpt_name=self.ckpt_name,
-            status_callback=update_discord_status # <-- NOVO
-        )
+        async def gerar_reroll(seal, status_callback):
+            async with fila_do_bot(interaction, job_kind, status_callback):
+                return await target_function(
+                    self.prompt, 
+                    self.negative_prompt, 
+                    steps=self.steps, 
+                    cfg=self.cfg, 
+                    sampler_name=self.sampler, 
+                    scheduler=self.scheduler, 
+                    ckpt_name=self.ckpt_name,
+                    status_callback=status_callback, # <-- NOVO
+                    count=seal()
+                )
+
+        job_key = (job_kind, self.prompt, self.negative_prompt, self.steps, self.cfg, self.sampler, self.scheduler, self.ckpt_name)
+        try:
+            images = await rodar_cancelavel(interaction, status_msg, rerolls_em_espera.submit(job_key, len(self.images), gerar_reroll, update_discord_status),
+                                            f'reroll_{job_kind}', self.ckpt_name)
+        except JobCancelado:
+            return
+        except Exception as e:
+            await interaction.channel.send(f"{interaction.user.mention} Erro crítico no ComfyUI: {e}")
+            return
         
-        collage_path = create_collage(images)
-        await interaction.channel.send(
-            content=f"{interaction.user.mention} Re-roll {mode_text}:", 
-            file=discord.File(fp=collage_path, filename='collage.png'),
-            view=Buttons(self.prompt, self.negative_prompt, images, self.ckpt_name, self.steps, self.cfg, self.sampler, self.scheduler, self.is_plus)
-        )
+        collage_file = await criar_colagem(images)
+        with metrics.timed('discord_send'), jobTrace.span('discord_send'):
+            await interaction.channel.send(
+                content=f"{interaction.user.mention} Re-roll {mode_text}:", 
+                file=collage_file,
+                view=Buttons(self.prompt, self.negative_prompt, images, self.ckpt_name, self.steps, self.cfg, self.sampler, self.scheduler, self.is_plus)
+            )
         await apagar_msg_carregando(interaction)
 
 class ImageButton(discord.ui.Button):
-    def __init__(self, label, emoji, row, callback):
+    def __init__(self, label, emoji, row, callback, index):
         super().__init__(label=label, style=discord.ButtonStyle.grey, emoji=emoji, row=row)
         self._callback = callback
+        self.index = index
     async def callback(self, interaction: discord.Interaction):
-        await self._callback(interaction, self)
+        await self._callback(interaction, self.index)
+
+class ImageSelect(discord.ui.Select):
+    """Menu com uma opção por imagem (1..N, V1..VN ou U1..UN), no lugar de uma linha de botões."""
+    def __init__(self, prefix, emoji, placeholder, count, row, callback):
+        options = [discord.SelectOption(label=f"{prefix}{idx + 1}", value=str(idx), emoji=emoji) for idx in range(count)]
+        super().__init__(placeholder=placeholder, options=options, row=row)
+        self._callback = callback
+    async def callback(self, interaction: discord.Interaction):
+        await self._callback(interaction, int(self.values[0]))
 
 # --- COMANDOS SLASH ---
 @tree.command(name="gerar", description="Gera uma imagem. Se não definir opções, usa o recomendado do modelo.")
@@ -307,10 +526,12 @@ class ImageButton(discord.ui.Button):
 @app_commands.describe(scheduler='Deixe vazio para usar o recomendado do modelo')
 @app_commands.describe(steps='Deixe vazio para usar o recomendado do modelo')
 @app_commands.describe(cfg='Deixe vazio para usar o recomendado do modelo')
+@app_commands.describe(quantidade='Quantas imagens gerar de uma vez (padrão do workflow se vazio)')
 @app_commands.choices(sampler=SAMPLER_CHOICES)
 @app_commands.choices(scheduler=SCHEDULER_CHOICES)
 # AQUI ESTÁ A MÁGICA: Usamos a lista que criamos lá em cima lendo o config
 @app_commands.choices(checkpoint=CHECKPOINT_CHOICES)
+@rastrear_job('gerar')
 async def slash_command(
     interaction: discord.Interaction, 
     prompt: str, 
@@ -319,7 +540,8 @@ async def slash_command(
     cfg: float = None,
     sampler: app_commands.Choice[str] = None,
     scheduler: app_commands.Choice[str] = None,
-    checkpoint: app_commands.Choice[str] = None
+    checkpoint: app_commands.Choice[str] = None,
+    quantidade: app_commands.Range[int, 1, MAX_BATCH] = None
 ):
     await interaction.response.send_message(f"{interaction.user.mention} Verificando modelo...", ephemeral=False)
 
@@ -355,43 +577,46 @@ async def slash_command(
         f"⚙️ **Config:** Steps: {final_steps} | CFG: {final_cfg} | Sampler: {final_sampler} | Scheduler: {final_scheduler}"
     )
     
-    # Atualiza a mensagem "Verificando modelo..." para o status de geração
-    await interaction.edit_original_response(content=status_msg,)
+    # A mensagem "Verificando modelo..." vira o status de geração (com o botão Cancelar) em rodar_cancelavel
     # ------------------------------
-    async def update_discord_status(status_text):
-        # Edita a mensagem adicionando o status atual no final
-        try:
-            await interaction.edit_original_response(content=f"{status_msg}\n> {status_text}...")
-        except:
-            pass # Ignora erros de rate limit do Discord se for muito rápido
+    # Edita a mensagem adicionando o status atual no final (coalescido, sem estourar rate limit)
+    update_discord_status = criar_status_callback(interaction, status_msg)
+
+    async def gerar():
+        async with fila_do_bot(interaction, 'gerar', update_discord_status):
+            return await generate_images(
+                prompt, 
+                negative_prompt, 
+                steps=final_steps, 
+                cfg=final_cfg, 
+                sampler_name=final_sampler, 
+                scheduler=final_scheduler, 
+                ckpt_name=final_ckpt_name,
+                status_callback=update_discord_status,
+                count=quantidade
+            )
 
     try:
-        images = await generate_images(
-            prompt, 
-            negative_prompt, 
-            steps=final_steps, 
-            cfg=final_cfg, 
-            sampler_name=final_sampler, 
-            scheduler=final_scheduler, 
-            ckpt_name=final_ckpt_name,
-            status_callback=update_discord_status
-        )
+        images = await rodar_cancelavel(interaction, status_msg, gerar(), 'gerar', final_ckpt_name, expira=True)
+    except JobCancelado:
+        return
     except Exception as e:
-        await interaction.channel.send(f"Erro crítico no ComfyUI: {e}", ephemeral=True)
+        await interaction.followup.send(f"Erro crítico no ComfyUI: {e}", ephemeral=True)
         return
 
     if not images:
-        await interaction.channel.send("O ComfyUI não retornou imagens.", ephemeral=True)
+        await interaction.followup.send("O ComfyUI não retornou imagens.", ephemeral=True)
         return
 
     infos = f"**Model:** {display_name}\n**Params:** Steps: {final_steps} | CFG: {final_cfg} | {final_sampler} / {final_scheduler}"
-    collage_path = create_collage(images)
+    collage_file = await criar_colagem(images)
 
-    await interaction.edit_original_response(
-        content=f"{interaction.user.mention} {infos}\n> **Prompt:** {prompt} **Negative Prompt:** {negative_prompt}", 
-        attachments=[discord.File(fp=collage_path, filename='collage.png')], 
-        view=Buttons(prompt, negative_prompt, images, final_ckpt_name, final_steps, final_cfg, final_sampler, final_scheduler, is_plus=False)
-    )
+    with metrics.timed('discord_send'), jobTrace.span('discord_send'):
+        await interaction.edit_original_response(
+            content=f"{interaction.user.mention} {infos}\n> **Prompt:** {prompt} **Negative Prompt:** {negative_prompt}", 
+            attachments=[collage_file], 
+            view=Buttons(prompt, negative_prompt, images, final_ckpt_name, final_steps, final_cfg, final_sampler, final_scheduler, is_plus=False)
+        )
 
 # --- COMANDO GERAR PLUS ---
 @tree.command(name="genplus", description="Gera imagem com Workflow PLUS (Mais detalhes/qualidade). ✨")
@@ -402,10 +627,12 @@ async def slash_command(
 @app_commands.describe(scheduler='Deixe vazio para usar o recomendado do modelo')
 @app_commands.describe(steps='Deixe vazio para usar o recomendado do modelo')
 @app_commands.describe(cfg='Deixe vazio para usar o recomendado do modelo')
+@app_commands.describe(quantidade='Quantas imagens gerar de uma vez (padrão do workflow se vazio)')
 @app_commands.choices(sampler=SAMPLER_CHOICES)
 @app_commands.choices(scheduler=SCHEDULER_CHOICES)
 # AQUI ESTÁ A MÁGICA: Usamos a lista que criamos lá em cima lendo o config
 @app_commands.choices(checkpoint=CHECKPOINT_CHOICES)
+@rastrear_job('genplus')
 async def gerarplus_command( 
     interaction: discord.Interaction, 
     prompt: str, 
@@ -414,7 +641,8 @@ async def gerarplus_command(
     cfg: float = None,
     sampler: app_commands.Choice[str] = None,
     scheduler: app_commands.Choice[str] = None,
-    checkpoint: app_commands.Choice[str] = None
+    checkpoint: app_commands.Choice[str] = None,
+    quantidade: app_commands.Range[int, 1, MAX_BATCH] = None
 ):
     await interaction.response.send_message(f"{interaction.user.mention} Verificando modelo...", ephemeral=False)
 
@@ -450,43 +678,46 @@ async def gerarplus_command(
         f"⚙️ **Config:** Steps: {final_steps} | CFG: {final_cfg} | Sampler: {final_sampler} | Scheduler: {final_scheduler}"
     )
     
-    # Atualiza a mensagem "Verificando modelo..." para o status de geração
-    await interaction.edit_original_response(content=status_msg,)
+    # A mensagem "Verificando modelo..." vira o status de geração (com o botão Cancelar) em rodar_cancelavel
     
-    async def update_discord_status(status_text):
-        try:
-            await interaction.edit_original_response(content=f"{status_msg}\n> {status_text}...")
-        except:
-            pass
+    update_discord_status = criar_status_callback(interaction, status_msg)
     # ------------------------------
 
+    async def gerar():
+        async with fila_do_bot(interaction, 'genplus', update_discord_status):
+            return await generate_images_plus(
+                prompt, 
+                negative_prompt, 
+                steps=final_steps, 
+                cfg=final_cfg, 
+                sampler_name=final_sampler, 
+                scheduler=final_scheduler, 
+                ckpt_name=final_ckpt_name,
+                status_callback=update_discord_status,
+                count=quantidade
+            )
+
     try:
-        images = await generate_images_plus(
-            prompt, 
-            negative_prompt, 
-            steps=final_steps, 
-            cfg=final_cfg, 
-            sampler_name=final_sampler, 
-            scheduler=final_scheduler, 
-            ckpt_name=final_ckpt_name,
-            status_callback=update_discord_status
-        )
+        images = await rodar_cancelavel(interaction, status_msg, gerar(), 'genplus', final_ckpt_name, expira=True)
+    except JobCancelado:
+        return
     except Exception as e:
-        await interaction.channel.send(f"Erro crítico no ComfyUI: {e}", ephemeral=True)
+        await interaction.followup.send(f"Erro crítico no ComfyUI: {e}", ephemeral=True)
         return
 
     if not images:
-        await interaction.channel.send("O ComfyUI não retornou imagens.", ephemeral=True)
+        await interaction.followup.send("O ComfyUI não retornou imagens.", ephemeral=True)
         return
 
     infos = f"**Model:** {display_name}\n**Params:** Steps: {final_steps} | CFG: {final_cfg} | {final_sampler} / {final_scheduler}"
-    collage_path = create_collage(images)
+    collage_file = await criar_colagem(images)
 
-    await interaction.edit_original_response(
-        content=f"{interaction.user.mention} {infos}\n> **Prompt:** {prompt} **Negative Prompt:** {negative_prompt}", 
-        attachments=[discord.File(fp=collage_path, filename='collage.png')], 
-        view=Buttons(prompt, negative_prompt, images, final_ckpt_name, final_steps, final_cfg, final_sampler, final_scheduler, is_plus=False)
-    )
+    with metrics.timed('discord_send'), jobTrace.span('discord_send'):
+        await interaction.edit_original_response(
+            content=f"{interaction.user.mention} {infos}\n> **Prompt:** {prompt} **Negative Prompt:** {negative_prompt}", 
+            attachments=[collage_file], 
+            view=Buttons(prompt, negative_prompt, images, final_ckpt_name, final_steps, final_cfg, final_sampler, final_scheduler, is_plus=False)
+        )
 
 # --- COMANDO HELP (BÁSICO) ---
 @tree.command(name="help", description="Aprenda o básico para gerar imagens comigo! 🎨")
@@ -660,4 +891,11 @@ async def checkpoints_command(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed)
 # run the bot
-client.run(TOKEN)
\ No newline at end of file
+if __name__ == "__main__":
+    # O pool de processos reimporta este arquivo nos workers (Windows/exe): só o principal conecta
+    multiprocessing.freeze_support()
+    try:
+        client.run(TOKEN)
+    finally:
+        image_executor.close()
+        output_store.flush()
@@ -0,0 +1,65 @@
+from io import BytesIO
+from math import ceil, sqrt
+
+from PIL import Image
+
+from imageHandle import ImageHandle
+
+# formato -> (formato do Pillow, extensão, opções de save)
+# PNG com compress_level=1: bem mais rápido que o padrão (6) e pouco maior.
+# WebP method=4 (padrão do libwebp) e JPEG sem optimize: bom equilíbrio tamanho/tempo.
+COLLAGE_FORMATS = {
+    'png': ('PNG', '.png', lambda quality: {'compress_level': 1}),
+    'webp': ('WEBP', '.webp', lambda quality: {'quality': quality, 'method': 4}),
+    'jpeg': ('JPEG', '.jpg', lambda quality: {'quality': quality}),
+}
+
+
+def build_collage(images, max_side=0, image_format='png', quality=85):
+    """
+    Monta a colagem das ImageHandle em memória e devolve (bytes, extensão).
+
+    max_side limita o maior lado da colagem (0 = tamanho original): cada imagem é reduzida
+    antes de colar, então o canvas e a codificação já são do tamanho da prévia.
+    Bloqueia (decodifica e codifica imagens): no bot, roda no executor de imagens
+    (image_executor.run com build_collage_from_bytes), fora do event loop.
+    """
+    if not images:
+        return None
+
+    pil_format, extension, options = COLLAGE_FORMATS[image_format]
+
+    num_images = len(images)
+    num_cols = ceil(sqrt(num_images))
+    num_rows = ceil(num_images / num_cols)
+
+    # Só o cabeçalho é lido aqui: tamanho da célula sem decodificar nada
+    cell_width = max(image.width for image in images)
+    cell_height = max(image.height for image in images)
+    scale = 1.0
+    if max_side:
+        scale = min(1.0, max_side / max(cell_width * num_cols, cell_height * num_rows))
+    cell_width = max(1, round(cell_width * scale))
+    cell_height = max(1, round(cell_height * scale))
+
+    collage = Image.new('RGB', (cell_width * num_cols, cell_height * num_rows))
+    for idx, image in enumerate(images):
+        row = idx // num_cols
+        col = idx % num_cols
+        # Decodifica só aqui, e solta os pixels logo depois de colar
+        with image.decode() as pixels:
+            if scale < 1.0:
+                size = (max(1, round(pixels.width * scale)), max(1, round(pixels.height * scale)))
+                tile = pixels.resize(size, Image.BILINEAR, reducing_gap=2.0)
+            else:
+                tile = pixels
+            collage.paste(tile, (col * cell_width, row * cell_height))
+
+    buffer = BytesIO()
+    collage.save(buffer, format=pil_format, **options(quality))
+    return buffer.getvalue(), extension
+
+
+def build_collage_from_bytes(image_datas, max_side=0, image_format='png', quality=85):
+    """Mesma coisa a partir dos bytes das imagens: é o que atravessa para o pool de processos."""
+    return build_collage([ImageHandle(data) for data in image_datas], max_side, image_format, quality)
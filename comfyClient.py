@@ -0,0 +1,357 @@
+import asyncio
+import json
+import random
+import uuid
+from collections import OrderedDict
+
+import aiohttp
+import websockets
+
+from queueTracker import QueueTracker
+
+# Quantos prompt_ids "órfãos" guardamos. São mensagens que chegam antes do job
+# se inscrever (entre o /prompt responder e o subscribe), ou depois dele sair.
+MAX_ORPHAN_PROMPTS = 64
+# E no máximo quantas mensagens por prompt órfão (previews podem ser muitas)
+MAX_ORPHAN_MESSAGES = 256
+# Segundos que as mensagens órfãs (e um prompt enviado que ainda não se inscreveu) ficam guardadas
+ORPHAN_TTL = 30
+
+# Tipos de frame binário do websocket do ComfyUI (server.BinaryEventTypes)
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+
+# Nó que devolve a imagem pelo websocket em vez de salvar em disco
+WEBSOCKET_SAVE_NODE = "SaveImageWebsocket"
+
+
+class ComfyError(Exception):
+    """Erro devolvido pela API REST do ComfyUI (status != 200)."""
+
+
+# Erros que indicam servidor fora do ar (vale tentar outro), e não prompt inválido
+BACKEND_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError, OSError, websockets.WebSocketException)
+
+
+def decode_image_frame(frame):
+    """Extrai os bytes da imagem de um frame binário do ComfyUI (None se não for imagem)."""
+    event = int.from_bytes(frame[:4], 'big')
+    if event == PREVIEW_IMAGE:
+        # [tipo do evento][formato (1=JPEG, 2=PNG)][imagem]
+        return frame[8:]
+    if event == PREVIEW_IMAGE_WITH_METADATA:
+        # [tipo do evento][tamanho do json][json de metadados][imagem]
+        metadata_length = int.from_bytes(frame[4:8], 'big')
+        return frame[8 + metadata_length:]
+    return None
+
+
+class ComfyClient:
+    """
+    Conexão única (por processo) com o websocket do ComfyUI.
+    Todos os jobs usam o mesmo client_id, e cada mensagem é entregue apenas
+    para o job dono do prompt_id, através de uma asyncio.Queue própria.
+
+    As chamadas REST (/prompt, /queue, /history, /view, /upload) usam uma
+    sessão aiohttp com keep-alive, timeout por requisição e concorrência limitada,
+    para nunca travar o event loop do discord.py.
+    """
+
+    def __init__(self, server_address, http_timeout=60, max_concurrency=8, upload_cache_size=256, queue_snapshot_ttl=2.0,
+                 reconnect_max_delay=30):
+        self.server_address = server_address
+        self.client_id = str(uuid.uuid4())
+        self.uri = f"ws://{server_address}/ws?clientId={self.client_id}"
+        self.base_url = f"http://{server_address}"
+        self.http_timeout = http_timeout
+        self.max_concurrency = max_concurrency
+        self._session = None
+        self._http_slots = asyncio.Semaphore(max_concurrency)
+        # hash do conteúdo -> nome do arquivo que o ComfyUI já tem em input/ (LRU)
+        self.upload_cache_size = upload_cache_size
+        self._uploaded = OrderedDict()
+        self.ws = None
+        self._reader_task = None
+        self._connect_lock = asyncio.Lock()
+        # Reconexão automática (mesmo client_id, então o ComfyUI continua mandando as mensagens)
+        self.reconnect_max_delay = reconnect_max_delay
+        self._reconnect_task = None
+        self._disconnected = False
+        self._closing = False
+        self._jobs = {}
+        self._orphans = OrderedDict()  # prompt_id -> (quando chegou a primeira, [mensagens])
+        # Prompts aceitos pelo /prompt cujo job ainda não chamou subscribe, e quantos /prompt
+        # estão em andamento: só para eles vale guardar frames binários sem dono
+        self._awaiting_subscribe = {}
+        self._submitting = 0
+        # Nós SaveImageWebsocket de cada job e o (prompt_id, nó) que está executando agora,
+        # já que o frame binário não diz de qual prompt ele é
+        self._binary_nodes = {}
+        self._executing = (None, None)
+        # Vira False se o servidor não tiver o nó SaveImageWebsocket
+        self.websocket_outputs = True
+        self.queue_tracker = QueueTracker(self, snapshot_ttl=queue_snapshot_ttl)
+        self._background = set()  # cancelamentos disparados por jobs que já saíram
+        # Estado usado pelo ComfyPool para escolher o servidor
+        self.healthy = True
+        self.reserved = 0  # jobs escolhidos para este servidor que ainda não entraram na fila
+        self.last_ckpt = None  # checkpoint do último job mandado para cá (o que vai estar carregado)
+
+    @property
+    def load(self):
+        """Profundidade efetiva da fila: o que o servidor tem + o que está a caminho."""
+        return self.queue_tracker.depth + self.reserved
+
+    @property
+    def connected(self):
+        return self.ws is not None and self._reader_task is not None and not self._reader_task.done()
+
+    async def connect(self):
+        # O lock evita que 20 /gerar simultâneos abram 20 sockets na primeira vez
+        async with self._connect_lock:
+            if self.connected:
+                return
+            # Sem permessage-deflate: os frames são PNG (já comprimido), e descomprimir
+            # vários MB por imagem no event loop deixava a entrega ~8x mais lenta
+            self.ws = await websockets.connect(self.uri, max_size=None, compression=None)
+            self._reader_task = asyncio.create_task(self._reader())
+            if self._disconnected:
+                # Voltou depois de uma queda: os jobs conferem no /history o que terminou enquanto isso
+                self._disconnected = False
+                print(f"Reconectado ao ComfyUI {self.server_address}")
+                self.queue_tracker.request_refresh()
+                for queue in self._jobs.values():
+                    queue.put_nowait({'type': 'reconnected', 'data': {}})
+
+    # --- HTTP ---
+    def _get_session(self):
+        # Criada sob demanda porque precisa de um event loop rodando
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.http_timeout),
+            )
+        return self._session
+
+    async def _request(self, method, path, *, timeout=None, raw=False, **kwargs):
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        async with self._http_slots:
+            async with self._get_session().request(method, self.base_url + path, **kwargs) as response:
+                if response.status != 200:
+                    raise ComfyError(f"{method} {path} -> {response.status}: {await response.text()}")
+                if raw:
+                    return await response.read()
+                return await response.json(content_type=None)
+
+    async def queue_prompt(self, prompt):
+        p = {"prompt": prompt, "client_id": self.client_id}
+        self._submitting += 1
+        try:
+            response = await self._request('POST', '/prompt', json=p)
+        finally:
+            self._submitting -= 1
+        if response.get('prompt_id'):
+            self._awaiting_subscribe[response['prompt_id']] = asyncio.get_running_loop().time()
+        return response
+
+    async def get_queue_info(self, raise_errors=False):
+        try:
+            return await self._request('GET', '/queue')
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"Erro ao ler fila: {e}")
+            return {"queue_running": [], "queue_pending": []}
+
+    async def get_history(self, prompt_id):
+        return await self._request('GET', f'/history/{prompt_id}')
+
+    async def get_image(self, filename, subfolder, folder_type):
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        return await self._request('GET', '/view', params=params, raw=True)
+
+    async def cancel(self, prompt_id):
+        """Tira o prompt da fila do servidor ou, se ele já estiver rodando, interrompe a GPU."""
+        await self._request('POST', '/queue', json={'delete': [prompt_id]})
+        # Só interrompe se o servidor avisou (executing) que é ele rodando: versões que ignoram
+        # o prompt_id no corpo interrompem o que estiver na GPU, que pode ser de outro usuário
+        if self._executing[0] == prompt_id:
+            await self._request('POST', '/interrupt', json={'prompt_id': prompt_id})
+
+    def cancel_soon(self, prompt_id):
+        """cancel() em segundo plano: quem cancelou não espera o servidor responder."""
+        async def run():
+            try:
+                await self.cancel(prompt_id)
+            except Exception as e:
+                print(f"Erro ao cancelar prompt {prompt_id} no ComfyUI: {e}")
+        task = asyncio.create_task(run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def upload_image(self, image_bytes, filename, subfolder=None, folder_type=None, overwrite=False):
+        """Envia a imagem direto da memória, sem passar por arquivo temporário."""
+        data = aiohttp.FormData()
+        data.add_field('image', image_bytes, filename=filename, content_type='image/png')
+        data.add_field('overwrite', str(overwrite).lower())
+        if subfolder:
+            data.add_field('subfolder', subfolder)
+        if folder_type:
+            data.add_field('type', folder_type)
+        return await self._request('POST', '/upload/image', data=data)
+
+    async def upload_cached(self, content_hash, get_bytes):
+        """
+        Devolve o nome no servidor de uma imagem identificada pelo hash do conteúdo.
+        get_bytes (async) só é chamado se o ComfyUI ainda não tiver essa imagem,
+        então V1 -> U1 -> V1 na mesma imagem não re-codifica nem re-envia nada.
+        """
+        name = self._uploaded.get(content_hash)
+        if name is not None:
+            self._uploaded.move_to_end(content_hash)
+            return name
+
+        image_bytes = await get_bytes()
+        # Nome determinístico: se o bot reiniciar, sobrescreve o mesmo arquivo em vez de acumular cópias
+        response = await self.upload_image(image_bytes, f"discordbot_{content_hash[:32]}.png", overwrite=True)
+        name = response['name']
+        if response.get('subfolder'):
+            name = f"{response['subfolder']}/{name}"
+
+        self._uploaded[content_hash] = name
+        while len(self._uploaded) > self.upload_cache_size:
+            self._uploaded.popitem(last=False)
+        return name
+
+    # --- WEBSOCKET ---
+    def subscribe(self, prompt_id, binary_nodes=()):
+        """
+        Registra um job e devolve a fila onde chegam as mensagens do prompt_id.
+        binary_nodes são os nós cujos frames binários (imagens) o job quer receber.
+        """
+        queue = asyncio.Queue()
+        binary_nodes = set(binary_nodes)
+        self._awaiting_subscribe.pop(prompt_id, None)
+        _, orphans = self._orphans.pop(prompt_id, (None, ()))
+        for message in orphans:
+            if message['type'] == 'binary' and message['data']['node'] not in binary_nodes:
+                continue
+            queue.put_nowait(message)
+        self._jobs[prompt_id] = queue
+        self._binary_nodes[prompt_id] = binary_nodes
+        return queue
+
+    def unsubscribe(self, prompt_id):
+        self.queue_tracker.untrack(prompt_id)
+        self._jobs.pop(prompt_id, None)
+        self._binary_nodes.pop(prompt_id, None)
+        self._orphans.pop(prompt_id, None)
+        self._awaiting_subscribe.pop(prompt_id, None)
+
+    def deliver(self, prompt_id, message):
+        """Entrega uma mensagem gerada pelo próprio bot (ex: posição na fila) a um job inscrito."""
+        queue = self._jobs.get(prompt_id)
+        if queue is not None:
+            queue.put_nowait(message)
+
+    def _dispatch(self, message):
+        self.queue_tracker.on_message(message)
+        data = message.get('data')
+        prompt_id = data.get('prompt_id') if isinstance(data, dict) else None
+        if prompt_id is None and message.get('type') == 'progress':
+            # Versões antigas do ComfyUI não mandam prompt_id no progresso: é do prompt executando
+            prompt_id = self._executing[0]
+        if prompt_id is None:
+            return
+
+        if message['type'] == 'executing':
+            self._executing = (prompt_id, data.get('node'))
+
+        queue = self._jobs.get(prompt_id)
+        if queue is not None:
+            queue.put_nowait(message)
+            return
+
+        # Ninguém esperando (ainda): guarda por pouco tempo, descartando os mais antigos
+        now = asyncio.get_running_loop().time()
+        self._expire_orphans(now)
+        _, pending = self._orphans.setdefault(prompt_id, (now, []))
+        if len(pending) < MAX_ORPHAN_MESSAGES:
+            pending.append(message)
+        while len(self._orphans) > MAX_ORPHAN_PROMPTS:
+            self._orphans.popitem(last=False)
+
+    def _expire_orphans(self, now):
+        # Em ordem de chegada: para no primeiro que ainda está dentro do prazo
+        while self._orphans and now - next(iter(self._orphans.values()))[0] > ORPHAN_TTL:
+            self._orphans.popitem(last=False)
+        for prompt_id, queued_at in list(self._awaiting_subscribe.items()):
+            if now - queued_at > ORPHAN_TTL:
+                del self._awaiting_subscribe[prompt_id]
+
+    def _dispatch_binary(self, frame):
+        prompt_id, node = self._executing
+        binary_nodes = self._binary_nodes.get(prompt_id)
+        # Job inscrito que não pediu esse nó: é preview do sampler, descarta sem copiar nada
+        if binary_nodes is not None and node not in binary_nodes:
+            return
+        if prompt_id is None:
+            return
+        # Sem dono: só guarda se o job ainda vai se inscrever (previews de job cancelado ou
+        # que estourou o tempo continuam chegando e não devem lotar os órfãos)
+        if binary_nodes is None and not self._submitting and prompt_id not in self._awaiting_subscribe:
+            return
+        self._dispatch({'type': 'binary', 'data': {'prompt_id': prompt_id, 'node': node, 'frame': frame}})
+
+    async def _reader(self):
+        try:
+            async for out in self.ws:
+                # Frames binários (previews ou imagens finais) não são JSON
+                if isinstance(out, bytes):
+                    self._dispatch_binary(out)
+                    continue
+                try:
+                    message = json.loads(out)
+                except ValueError:
+                    print("Incompatible response from ComfyUI")
+                    continue
+                self._dispatch(message)
+        except (websockets.ConnectionClosed, OSError) as e:
+            print(f"Conexão com o ComfyUI caiu: {e}")
+        finally:
+            self.ws = None
+            self._disconnected = True
+            # Avisa quem estava esperando; o job continua no servidor e as mensagens voltam na reconexão
+            for queue in self._jobs.values():
+                queue.put_nowait({'type': 'connection_closed', 'data': {}})
+            if not self._closing and (self._reconnect_task is None or self._reconnect_task.done()):
+                self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        """Tenta reabrir o websocket com backoff exponencial enquanto houver jobs esperando."""
+        delay = 0.5
+        while not self._closing and self._jobs and not self.connected:
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            try:
+                await self.connect()
+            except BACKEND_ERRORS as e:
+                delay = min(delay * 2, self.reconnect_max_delay)
+                print(f"Reconexão com o ComfyUI {self.server_address} falhou ({e}), tentando de novo em ~{delay:.0f}s")
+
+    async def close(self):
+        self._closing = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            await asyncio.gather(self._reconnect_task, return_exceptions=True)
+            self._reconnect_task = None
+        if self.ws:
+            await self.ws.close()
+        if self._reader_task:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+            self._reader_task = None
+        await self.queue_tracker.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
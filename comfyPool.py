@@ -0,0 +1,108 @@
+import asyncio
+
+
+class ComfyPool:
+    """
+    Conjunto de servidores ComfyUI (SERVER_ADDRESS = host1:8188, host2:8188, ...).
+
+    Cada job vai para o servidor saudável com a menor fila efetiva
+    (fila vista pelo QueueTracker + jobs já escolhidos a caminho dele).
+    Se algum servidor já estiver com o checkpoint do job carregado (último enviado a ele)
+    e a fila dele for no máximo affinity_slack jobs maior, ele ganha: trocar de modelo
+    SDXL costuma custar mais que esperar um ou dois jobs.
+    Um health check periódico relê o /queue de cada servidor e reabre o websocket;
+    quem falhar sai da escolha até voltar a responder.
+    """
+
+    def __init__(self, clients, health_interval=15, affinity_slack=2, affinity_report_every=50):
+        self.clients = list(clients)
+        self.health_interval = health_interval
+        self.affinity_slack = affinity_slack
+        self.affinity_report_every = affinity_report_every
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+        self._health_task = None
+
+    def pick(self, exclude=(), ckpt_name=None, prefer=None):
+        """
+        Escolhe o servidor para o próximo job (None se todos já foram tentados).
+        prefer é o endereço do servidor que já tem a imagem de entrada salva; ele ganha
+        nas mesmas condições da afinidade de checkpoint.
+        """
+        self._ensure_health_loop()
+        candidates = [c for c in self.clients if c not in exclude]
+        healthy = [c for c in candidates if c.healthy]
+        # Se todos parecem fora do ar, tenta mesmo assim: pode ter voltado antes do health check
+        candidates = healthy or candidates
+        if not candidates:
+            return None
+
+        if ckpt_name is None:
+            best = min(candidates, key=lambda c: c.load)
+        else:
+            # No empate, um servidor ainda sem checkpoint nenhum evita descarregar o modelo de outro
+            best = min(candidates, key=lambda c: (c.load, c.last_ckpt is not None))
+        least_load = best.load
+
+        loaded = [c for c in candidates if ckpt_name is not None and c.last_ckpt == ckpt_name]
+        if loaded:
+            affine = min(loaded, key=lambda c: c.load)
+            if affine.load <= least_load + self.affinity_slack:
+                best = affine
+
+        holder = next((c for c in candidates if prefer is not None and c.server_address == prefer), None)
+        if holder is not None and holder.load <= least_load + self.affinity_slack:
+            best = holder
+        return best
+
+    def submitted(self, client, ckpt_name):
+        """
+        Registra um job aceito pelo servidor: só aqui ele passa a ter o checkpoint carregado
+        (um envio que falhou e foi para outro servidor não conta), e a afinidade é contada uma vez por job.
+        """
+        if ckpt_name is None:
+            return
+        hit = client.last_ckpt == ckpt_name
+        client.last_ckpt = ckpt_name
+        if hit:
+            self.affinity_hits += 1
+        else:
+            self.affinity_misses += 1
+        total = self.affinity_hits + self.affinity_misses
+        if self.affinity_report_every and total % self.affinity_report_every == 0:
+            print(f"Afinidade de checkpoint: {self.affinity_hits}/{total} jobs "
+                  f"({100 * self.affinity_hits / total:.0f}%) sem troca de modelo")
+
+    def mark_down(self, client, error):
+        if client.healthy:
+            print(f"ComfyUI {client.server_address} fora do ar: {error}")
+        client.healthy = False
+
+    def _ensure_health_loop(self):
+        if self.health_interval and len(self.clients) > 1 and (self._health_task is None or self._health_task.done()):
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(self._check(client) for client in self.clients))
+            await asyncio.sleep(self.health_interval)
+
+    async def _check(self, client):
+        try:
+            await client.queue_tracker.refresh()
+            await client.connect()
+        except Exception as e:
+            self.mark_down(client, e)
+            return
+        if not client.healthy:
+            print(f"ComfyUI {client.server_address} voltou")
+            client.healthy = True
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for client in self.clients:
+            await client.close()
+
@@ -0,0 +1,91 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ImageExecutor:
+    """
+    Executor único para o trabalho de CPU com imagens (decodificar, redimensionar, colar, codificar).
+
+    Por padrão usa processos: o Pillow segura o GIL em boa parte do trabalho e, no processo
+    do bot, isso atrasa heartbeat do gateway e respostas de interação. Só bytes e números
+    atravessam a fronteira do processo, então as funções enviadas precisam ser de módulo
+    (picláveis) e receber/devolver bytes.
+    Se o pool de processos não puder ser criado ou quebrar, cai para threads.
+
+    pending é a profundidade da fila (enviados e ainda não terminados); o pico é
+    impresso a cada report_interval segundos.
+    """
+
+    def __init__(self, workers=None, use_processes=True, report_interval=300):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.use_processes = use_processes
+        self.report_interval = report_interval
+        self._executor = None
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self._last_report = None
+
+    @property
+    def mode(self):
+        return 'process' if self.use_processes else 'thread'
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.use_processes:
+                try:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                except (OSError, NotImplementedError, ImportError) as e:
+                    self._fall_back(e)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image')
+        return self._executor
+
+    def _fall_back(self, error):
+        print(f"Pool de processos de imagem indisponível ({error}), usando threads")
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.use_processes = False
+
+    async def run(self, func, *args):
+        """Roda func(*args) no pool e devolve o resultado."""
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        self._maybe_report(loop.time())
+        try:
+            try:
+                return await loop.run_in_executor(self._get_executor(), func, *args)
+            except BrokenProcessPool as e:
+                # Worker morreu (ou o sistema não deixa criar processos): tenta de novo em thread
+                self._fall_back(e)
+                return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+        }
+
+    def _maybe_report(self, now):
+        if self._last_report is None:
+            self._last_report = now
+        elif self.report_interval and now - self._last_report >= self.report_interval:
+            self._last_report = now
+            print(f"Executor de imagens ({self.mode}, {self.workers} workers): fila {self.pending}, "
+                  f"pico {self.max_pending}, {self.completed} tarefas")
+            self.max_pending = self.pending
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
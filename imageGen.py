@@ -1,24 +1,45 @@
-import websockets
-import uuid
-import json
 import random
-import urllib.request
-import urllib.parse
-from PIL import Image
-from io import BytesIO
+import asyncio
 import configparser
-import os
-import tempfile
-import requests
+import time
+from comfyClient import ComfyClient, ComfyError, BACKEND_ERRORS, WEBSOCKET_SAVE_NODE, decode_image_frame
+from comfyPool import ComfyPool
+from workflowTemplates import load_templates
+from imageHandle import ImageHandle, OutputRef
+import metrics
+import jobTrace
 
 # Read the configuration
 config = configparser.ConfigParser()
 config.read('config.properties', encoding='utf-8')
-server_address = config['LOCAL']['SERVER_ADDRESS']
-text2img_config = config['LOCAL_TEXT2IMG']['CONFIG']
-text2imgplus_config = config['LOCAL_TEXT2IMG_PLUS']['CONFIG']
-img2img_config = config['LOCAL_IMG2IMG']['CONFIG']
-upscale_config = config['LOCAL_UPSCALE']['CONFIG']
+# Um ou mais servidores ComfyUI separados por vírgula (ex: 127.0.0.1:8188, 192.168.0.10:8188)
+server_addresses = [address.strip() for address in config['LOCAL']['SERVER_ADDRESS'].split(',') if address.strip()]
+
+# Workflows lidos e pré-compilados uma vez só, na inicialização
+TEMPLATES = load_templates(config, ['LOCAL_TEXT2IMG', 'LOCAL_TEXT2IMG_PLUS', 'LOCAL_IMG2IMG', 'LOCAL_UPSCALE'])
+
+# Cliente HTTP do ComfyUI: timeout por requisição (segundos) e máximo de requisições simultâneas
+http_timeout = config.getfloat('LOCAL', 'HTTP_TIMEOUT', fallback=60)
+http_max_concurrency = config.getint('LOCAL', 'HTTP_MAX_CONCURRENCY', fallback=8)
+# Quantas imagens enviadas (variação/upscale) lembramos para não enviar de novo
+upload_cache_size = config.getint('LOCAL', 'UPLOAD_CACHE_SIZE', fallback=256)
+# Recebe as imagens finais direto pelo websocket (precisa do nó SaveImageWebsocket no ComfyUI)
+websocket_outputs = config.getboolean('LOCAL', 'WEBSOCKET_OUTPUTS', fallback=False)
+# Intervalo mínimo (segundos) entre leituras do /queue para corrigir as posições na fila
+queue_snapshot_ttl = config.getfloat('LOCAL', 'QUEUE_SNAPSHOT_TTL', fallback=2.0)
+# Intervalo mínimo (segundos) entre avisos de progresso (passo X/Y) de um mesmo job
+progress_interval = config.getfloat('LOCAL', 'PROGRESS_INTERVAL', fallback=1.0)
+# Intervalo (segundos) do health check de cada servidor quando há mais de um
+health_check_interval = config.getfloat('LOCAL', 'HEALTH_CHECK_INTERVAL', fallback=15)
+# Quantos jobs a mais na fila aceitamos para mandar o job a um servidor que já tem o checkpoint carregado
+affinity_slack = config.getint('LOCAL', 'AFFINITY_SLACK', fallback=2)
+# Tempos limite (segundos, 0 = sem limite) de cada etapa de um job no ComfyUI:
+# esperando na fila, rodando no total, e rodando sem nenhuma mensagem do servidor (travado)
+queue_timeout = config.getfloat('LOCAL', 'QUEUE_TIMEOUT', fallback=1800)
+execution_timeout = config.getfloat('LOCAL', 'EXECUTION_TIMEOUT', fallback=1800)
+execution_idle_timeout = config.getfloat('LOCAL', 'EXECUTION_IDLE_TIMEOUT', fallback=300)
+# Espera máxima (segundos) entre tentativas de reconectar o websocket depois de uma queda
+reconnect_max_delay = config.getfloat('LOCAL', 'RECONNECT_MAX_DELAY', fallback=30)
 
 callback_time = 3600 # Define o tempo para realizar ações em botões em segundos.
 
@@ -61,376 +82,461 @@ NODE_TRANSLATION = {
     "CR Seed": "🌱 Semeando o Caos"
 }
 
-def queue_prompt(prompt, client_id):
-    p = {"prompt": prompt, "client_id": client_id}
-    data = json.dumps(p).encode('utf-8')
-    req =  urllib.request.Request("http://{}/prompt".format(server_address), data=data)
-    return json.loads(urllib.request.urlopen(req).read())
-
-def get_queue_info():
-    try:
-        with urllib.request.urlopen(f"http://{server_address}/queue") as response:
-            return json.loads(response.read())
-    except Exception as e:
-        print(f"Erro ao ler fila: {e}")
-        return {"queue_running": [], "queue_pending": []}
-
-def get_image(filename, subfolder, folder_type):
-    data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url_values = urllib.parse.urlencode(data)
-    with urllib.request.urlopen("http://{}/view?{}".format(server_address, url_values)) as response:
-        return response.read()
-
-def get_history(prompt_id):
-    with urllib.request.urlopen("http://{}/history/{}".format(server_address, prompt_id)) as response:
-        return json.loads(response.read())
-    
-def upload_image(filepath, subfolder=None, folder_type=None, overwrite=False):
-    url = f"http://{server_address}/upload/image"
-    files = {'image': open(filepath, 'rb')}
-    data = {
-        'overwrite': str(overwrite).lower()
-    }
-    if subfolder:
-        data['subfolder'] = subfolder
-    if folder_type:
-        data['type'] = folder_type
-    response = requests.post(url, files=files, data=data)
-    return response.json()
-
-# --- FUNÇÃO AUXILIAR INTELIGENTE PARA SETAR VALORES ---
-def set_node_values(workflow, nodes_str, field_key, value, is_string_number=False):
+# Nós que salvam a imagem final em disco (trocados no modo WEBSOCKET_OUTPUTS)
+SAVE_NODE_CLASSES = ("SaveImage", "Image Save")
+
+# Servidores ComfyUI, cada um com uma conexão websocket compartilhada por todos os jobs
+_comfy_pool = None
+
+def get_comfy_pool():
+    global _comfy_pool
+    if _comfy_pool is None:
+        clients = [
+            ComfyClient(
+                address,
+                http_timeout=http_timeout,
+                max_concurrency=http_max_concurrency,
+                upload_cache_size=upload_cache_size,
+                queue_snapshot_ttl=queue_snapshot_ttl,
+                reconnect_max_delay=reconnect_max_delay,
+            )
+            for address in server_addresses
+        ]
+        _comfy_pool = ComfyPool(clients, health_interval=health_check_interval, affinity_slack=affinity_slack)
+    return _comfy_pool
+
+async def upload_image_handle(client: ComfyClient, image: ImageHandle):
+    """Envia a imagem para o servidor (se ele ainda não tiver) e devolve o nome para o LoadImage."""
+    # Os bytes originais vão direto, sem decodificar nem re-codificar em PNG
+    async def get_bytes():
+        return image.data
+
+    return await client.upload_cached(image.content_hash, get_bytes)
+
+def input_image_binder(job, image: ImageHandle):
     """
-    Lê a string de nós do config (ex: "89, 90"), itera sobre eles e define o valor.
-    Tenta ser inteligente sobre o nome do campo se field_key for genérico.
+    Prepara o job no servidor escolhido. Se a imagem foi gerada por ele, o LoadImage lê
+    direto da pasta output/ (nada é enviado); se não, ela é enviada para o input/ dele.
+    prepare devolve (workflow, usou_saida_do_servidor).
     """
-    if not nodes_str or nodes_str.strip() == "":
-        return
-
-    node_ids = [n.strip() for n in nodes_str.split(',') if n.strip()]
-    
-    for node_id in node_ids:
-        if node_id in workflow:
-            inputs = workflow[node_id]['inputs']
-            
-            # Tratamento especial para CFG que as vezes é String no ComfyUI
-            final_value = str(value) if is_string_number else value
-
-            # Se o campo solicitado existe, usa ele
-            if field_key in inputs:
-                inputs[field_key] = final_value
-            # Se não, tenta adivinhar campos comuns para Primitives
-            elif 'value' in inputs:
-                inputs['value'] = final_value
-            elif 'Number' in inputs: # Caso específico do nó Float to String
-                inputs['Number'] = str(value)
-            elif 'text' in inputs and isinstance(value, str):
-                inputs['text'] = value
-            elif 'string_b' in inputs and isinstance(value, str): # Concatenate
-                 inputs['string_b'] = value
+    async def prepare(client, reuse_outputs=True):
+        if reuse_outputs and image.ref is not None and image.ref.server_address == client.server_address:
+            job.set('image', image.ref.load_name)
+            return job.workflow, True
+        if not reuse_outputs:
+            # O servidor recusou a saída (apagada?): os próximos cliques já enviam direto
+            image.ref = None
+        job.set('image', await upload_image_handle(client, image))
+        return job.workflow, False
+    return prepare
+
+def to_websocket_outputs(workflow, output_nodes=()):
+    """
+    Troca os nós de salvar imagem por SaveImageWebsocket. Devolve (workflow novo, ids trocados).
+    Com OUTPUT_NODES só esses são trocados, os outros continuam salvando em disco normalmente.
+    """
+    ws_workflow = dict(workflow)
+    node_ids = []
+    for node_id, node in workflow.items():
+        if output_nodes and node_id not in output_nodes:
+            continue
+        if node.get('class_type') in SAVE_NODE_CLASSES and 'images' in node['inputs']:
+            ws_workflow[node_id] = {'class_type': WEBSOCKET_SAVE_NODE, 'inputs': {'images': node['inputs']['images']}}
+            node_ids.append(node_id)
+    return ws_workflow, node_ids
 
 class ImageGenerator:
     def __init__(self):
-        self.client_id = str(uuid.uuid4())
-        self.uri = f"ws://{server_address}/ws?clientId={self.client_id}"
-        self.ws = None
+        self.pool = get_comfy_pool()
+        self.client = None
 
-    async def connect(self):
-        self.ws = await websockets.connect(self.uri)
+    async def _queue(self, client, workflow, output_nodes):
+        """Envia o prompt (com as saídas pelo websocket, se ativado). Devolve (resposta, nós binários)."""
+        if websocket_outputs and client.websocket_outputs:
+            ws_workflow, binary_nodes = to_websocket_outputs(workflow, output_nodes)
+            try:
+                return await client.queue_prompt(ws_workflow), binary_nodes
+            except ComfyError as e:
+                if WEBSOCKET_SAVE_NODE not in str(e):
+                    raise
+                print(f"ComfyUI {client.server_address} sem o nó SaveImageWebsocket, usando /history + /view")
+                client.websocket_outputs = False
+        return await client.queue_prompt(workflow), []
+
+    async def _queue_shielded(self, client, workflow, output_nodes):
+        """
+        _queue protegido de cancelamento: se o job for cancelado com o /prompt no ar, o servidor
+        ainda pode aceitar o prompt, e ele sai da fila assim que o prompt_id chegar.
+        """
+        task = asyncio.ensure_future(self._queue(client, workflow, output_nodes))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            def cancel_queued(done):
+                if not done.cancelled() and done.exception() is None:
+                    client.cancel_soon(done.result()[0]['prompt_id'])
+            task.add_done_callback(cancel_queued)
+            raise
+
+    async def _submit(self, workflow, output_nodes, prepare, ckpt_name, prefer_server):
+        """Escolhe o servidor e enfileira o job; se o servidor estiver fora do ar, tenta o próximo."""
+        tried = set()
+        while True:
+            client = self.pool.pick(exclude=tried, ckpt_name=ckpt_name, prefer=prefer_server)
+            if client is None:
+                raise ComfyError("Nenhum servidor ComfyUI disponível")
+            client.reserved += 1
+            try:
+                await client.connect()
+                chained = False
+                if prepare is not None:
+                    with jobTrace.span('input_image', server=client.server_address):
+                        workflow, chained = await prepare(client)
+                try:
+                    with jobTrace.span('queue_prompt', server=client.server_address):
+                        prompt_response, binary_nodes = await self._queue_shielded(client, workflow, output_nodes)
+                except ComfyError as e:
+                    if not chained:
+                        raise
+                    # A saída pode ter sido apagada do servidor: manda os bytes e tenta de novo
+                    print(f"ComfyUI recusou a imagem de saída reaproveitada ({e}), enviando a imagem")
+                    with jobTrace.span('input_image', server=client.server_address, retry=True):
+                        workflow, _ = await prepare(client, reuse_outputs=False)
+                    with jobTrace.span('queue_prompt', server=client.server_address, retry=True):
+                        prompt_response, binary_nodes = await self._queue_shielded(client, workflow, output_nodes)
+                self.pool.submitted(client, ckpt_name)
+                return client, prompt_response, binary_nodes
+            except BACKEND_ERRORS as e:
+                self.pool.mark_down(client, e)
+                tried.add(client)
+            finally:
+                client.reserved -= 1
 
     # ALTERAÇÃO AQUI: Adicionado status_callback
-    async def get_images(self, workflow, status_callback=None):
-        if not self.ws:
-            await self.connect()
-            
+    async def get_images(self, workflow, status_callback=None, output_nodes=(), prepare=None, ckpt_name=None, prefer_server=None):
+        """
+        Roda o workflow e devolve as imagens de saída.
+        prepare(client) é chamado no servidor escolhido antes de enfileirar (ex: enviar a imagem
+        de entrada) e devolve o workflow final. ckpt_name e prefer_server (servidor que já tem
+        a imagem de entrada) guiam a escolha do servidor.
+        """
+        labels = metrics.job_labels(checkpoint=ckpt_name or '-')
+        submit_started = asyncio.get_running_loop().time()
         try:
-            # 1. Envia o prompt
-            prompt_response = queue_prompt(workflow, self.client_id)
+            client, prompt_response, binary_nodes = await self._submit(workflow, output_nodes, prepare, ckpt_name, prefer_server)
             prompt_id = prompt_response['prompt_id']
-            
-            # --- CÁLCULO DA FILA (NOVO) ---
-            # Verifica imediatamente onde fomos parar
-            if status_callback and callable(status_callback):
-                queue_data = get_queue_info()
-                running = queue_data.get('queue_running', [])
-                pending = queue_data.get('queue_pending', [])
-                
-                position = 0
-                found = False
-
-                # Se já tem gente rodando, a fila começa depois deles
-                if len(running) > 0:
-                    # Verifica se SOU EU rodando agora
-                    for task in running:
-                        if task[1] == prompt_id:
-                            await status_callback("🔨 Já iniciou o processamento...")
-                            found = True
-                            break
-                    if not found:
-                        position += len(running)
-
-                # Se não estou rodando, procuro minha posição na espera
-                if not found:
-                    for i, task in enumerate(pending):
-                        if task[1] == prompt_id:
-                            # Minha posição é: quem tá rodando + quantos estão na minha frente + eu
-                            my_real_pos = position + i + 1
-                            await status_callback(f"⏳ Na fila: Posição {my_real_pos}")
-                            found = True
-                            break
-            # -----------------------------
-
         except Exception as e:
             print(f"Erro ao enviar prompt para o ComfyUI: {e}")
+            jobTrace.annotate(error=f"submit: {e}")
             return []
-
-        output_images = []
+        metrics.STAGE_SECONDS.observe(asyncio.get_running_loop().time() - submit_started, stage='submit', **labels)
+        jobTrace.annotate(prompt_id=prompt_id, server=client.server_address)
+        self.client = client
+
+        # Inscreve o job antes de qualquer await, as mensagens que chegaram antes ficam guardadas
+        messages = client.subscribe(prompt_id, binary_nodes)
+        # A posição na fila chega como mensagem 'queue_position' sempre que mudar
+        client.queue_tracker.track(prompt_id, prompt_response.get('number', 0))
+        try:
+            return await self._wait_images(workflow, prompt_id, messages, status_callback, output_nodes, labels, binary_nodes)
+        except asyncio.CancelledError:
+            # Job cancelado (botão, interação expirada): libera a vaga já e tira o prompt da GPU
+            client.cancel_soon(prompt_id)
+            raise
+        finally:
+            client.unsubscribe(prompt_id)
+
+    async def _notify(self, status_callback, status_text):
+        # Adicionado 'callable(status_callback)'
+        if not (status_callback and callable(status_callback)):
+            return
+        try:
+            await status_callback(status_text)
+        except Exception as e:
+            print(f"Erro ao atualizar status: {e}")
+
+    def _stage_timeout(self, now, queued_at, started_at):
+        """Quanto tempo esperar pela próxima mensagem na etapa atual (None = sem limite)."""
+        if started_at is None:
+            return max(0, queued_at + queue_timeout - now) if queue_timeout else None
+        limits = [limit for limit in (
+            started_at + execution_timeout - now if execution_timeout else None,
+            execution_idle_timeout or None,
+        ) if limit is not None]
+        return max(0, min(limits)) if limits else None
+
+    async def _wait_images(self, workflow, prompt_id, messages, status_callback, output_nodes, labels, binary_nodes=()):
+        loop = asyncio.get_running_loop()
+        # Imagens que chegaram pelo websocket (modo WEBSOCKET_OUTPUTS)
+        streamed_images = []
+        # Nó executando agora e quando ele começou, para mostrar passo e tempo decorrido
+        readable_status = None
+        node_started = loop.time()
+        last_progress = None
+        # Etapas do job, para os tempos limite
+        queued_at = loop.time()
+        started_at = None
+        # Entrada do /history, se já foi lida para recuperar o job depois de uma reconexão
+        history_entry = None
+        # Classe do nó executando agora, para o tempo por nó nas métricas
+        node_class = None
             
-        async for out in self.ws:
+        while True:
+            timeout = self._stage_timeout(loop.time(), queued_at, started_at)
             try:
-                message = json.loads(out)
-
-                    
-                if message['type'] == 'executing':
-                    data = message['data']
-                    if data['node'] is None and data['prompt_id'] == prompt_id:
-                        break 
-
-                    # Adicionado 'callable(status_callback)'
-                    if status_callback and callable(status_callback) and data['node'] in workflow:
-                        node_id = data['node']
-                        node_class = workflow[node_id].get('class_type', 'Unknown')
-                        readable_status = NODE_TRANSLATION.get(node_class, f"⚙️ Processando: {node_class}")
-                        
-                        try:
-                            await status_callback(readable_status)
-                        except Exception as e:
-                            print(f"Erro ao atualizar status: {e}")
-
-            except ValueError as e:
-                print("Incompatible response from ComfyUI")
-                
-        history = get_history(prompt_id)[prompt_id]
-
-        for node_id in history['outputs']:
-            node_output = history['outputs'][node_id]
-            if 'images' in node_output:
-                for image in node_output['images']:
-                    image_data = get_image(image['filename'], image['subfolder'], image['type'])
-                    if 'final_output' in image['filename'] or 'upscaled' in image['filename'] or 'output' in image['filename']:
-                        pil_image = Image.open(BytesIO(image_data))
-                        output_images.append(pil_image)
-                    elif len(output_images) == 0:
-                        pil_image = Image.open(BytesIO(image_data))
-                        output_images.append(pil_image)
-
-        return output_images
+                message = await asyncio.wait_for(messages.get(), timeout)
+            except asyncio.TimeoutError:
+                stage = "na fila" if started_at is None else "executando"
+                self.client.cancel_soon(prompt_id)
+                raise ComfyError(f"Tempo esgotado {stage} no ComfyUI ({loop.time() - queued_at:.0f}s)")
+
+            if started_at is None and (message['type'] in ('execution_start', 'executing', 'progress')
+                                       or message['type'] == 'queue_position' and message['data']['position'] == 0):
+                started_at = loop.time()
+                metrics.STAGE_SECONDS.observe(started_at - queued_at, stage='queue_wait', **labels)
+                jobTrace.add_span('queue_wait', queued_at, started_at)
+
+            if message['type'] == 'execution_cached':
+                # Nós que o ComfyUI pulou porque a saída deles já estava em cache
+                cached_nodes = message['data'].get('nodes') or ()
+                metrics.CACHED_NODES.inc(len(cached_nodes), **labels)
+                jobTrace.annotate(cached_nodes=len(cached_nodes))
+                continue
+
+            if message['type'] == 'execution_error':
+                data = message['data']
+                raise ComfyError(f"Erro no nó {data.get('node_type', data.get('node_id'))}: {data.get('exception_message', '').strip()}")
+
+            if message['type'] == 'execution_interrupted':
+                raise ComfyError("Execução interrompida no ComfyUI")
+
+            if message['type'] == 'connection_closed':
+                # O prompt continua no servidor: espera a reconexão (os tempos limite continuam valendo)
+                await self._notify(status_callback, "🔌 Conexão com o ComfyUI caiu, reconectando")
+                continue
+
+            if message['type'] == 'reconnected':
+                # O /queue antes do /history: um prompt que termina entre as duas leituras aparece no segundo
+                queue_info = await self.client.get_queue_info(raise_errors=True)
+                queued = {task[1] for key in ('queue_running', 'queue_pending') for task in queue_info.get(key, [])}
+                if prompt_id in queued:
+                    await self._notify(status_callback, "🔌 Reconectado, aguardando o ComfyUI")
+                    continue
+                # O fim do job pode ter passado durante a queda: o /history diz se já terminou
+                history_entry = (await self.client.get_history(prompt_id)).get(prompt_id)
+                if history_entry is not None:
+                    print(f"Prompt {prompt_id} terminou durante a queda do websocket, recuperado pelo histórico")
+                    break
+                # Nem na fila nem no histórico: o ComfyUI reiniciou e o prompt se perdeu
+                self.client.queue_tracker.forget(prompt_id)
+                raise ComfyError("O ComfyUI reiniciou e perdeu o job, tente de novo")
+
+            if message['type'] == 'queue_position':
+                position = message['data']['position']
+                if position == 0:
+                    await self._notify(status_callback, "🔨 Já iniciou o processamento...")
+                else:
+                    await self._notify(status_callback, f"⏳ Na fila: Posição {position}")
+                continue
+
+            if message['type'] == 'binary':
+                image_data = decode_image_frame(message['data']['frame'])
+                if image_data:
+                    streamed_images.append(image_data)
+                continue
+
+            if message['type'] == 'executing':
+                data = message['data']
+                if node_class is not None:
+                    now = loop.time()
+                    metrics.NODE_SECONDS.observe(now - node_started, node_class=node_class, **labels)
+                    jobTrace.add_span('node', node_started, now, node_id=node_id, class_type=node_class)
+                    node_class = None
+                if data['node'] is None:
+                    break 
+
+                if data['node'] in workflow:
+                    node_id = data['node']
+                    node_class = workflow[node_id].get('class_type', 'Unknown')
+                    readable_status = NODE_TRANSLATION.get(node_class, f"⚙️ Processando: {node_class}")
+                    node_started = loop.time()
+                    last_progress = None
+                    await self._notify(status_callback, readable_status)
+                continue
+
+            if message['type'] == 'progress':
+                # Sampler, FaceDetailer, UltimateSDUpscale... mandam value/max a cada passo
+                data = message['data']
+                now = loop.time()
+                finished = data['value'] >= data['max']
+                if not finished and last_progress is not None and now - last_progress < progress_interval:
+                    continue
+                last_progress = now
+                label = readable_status or "⚙️ Processando"
+                await self._notify(status_callback, f"{label} {data['value']}/{data['max']} ({now - node_started:.0f}s)")
+
+        finished_at = loop.time()
+        if started_at is not None:
+            metrics.STAGE_SECONDS.observe(finished_at - started_at, stage='execution', **labels)
+            jobTrace.add_span('execution', started_at, finished_at)
+        if streamed_images:
+            return [ImageHandle(image_data) for image_data in streamed_images]
+        if binary_nodes:
+            # SaveImageWebsocket não grava nada no /history: sem os frames (ex: job terminou
+            # durante uma queda do websocket) não há de onde recuperar as imagens
+            raise ComfyError("O ComfyUI não mandou as imagens pelo websocket")
+
+        # Caminho padrão (ou fallback): lê o histórico e baixa só as imagens de saída
+        if history_entry is None:
+            with jobTrace.span('history_fetch'):
+                history_entry = (await self.client.get_history(prompt_id))[prompt_id]
+        status = history_entry.get('status') or {}
+        if status.get('status_str') == 'error':
+            # Erro que aconteceu enquanto o websocket estava fora (a mensagem execution_error se perdeu)
+            raise ComfyError("O ComfyUI terminou o job com erro")
+        outputs = history_entry['outputs']
+
+        if output_nodes:
+            wanted = [image for node_id in output_nodes for image in outputs.get(node_id, {}).get('images', [])]
+        else:
+            # Sem OUTPUT_NODES no config: tudo que foi salvo como saída (ignora previews 'temp')
+            wanted = [image for node_output in outputs.values() for image in node_output.get('images', []) if image.get('type') == 'output']
+
+        async def download(image):
+            with jobTrace.span('download', filename=image['filename']):
+                return await self.client.get_image(image['filename'], image['subfolder'], image['type'])
+
+        # Downloads em paralelo, mantendo a ordem
+        downloads = await asyncio.gather(*(download(image) for image in wanted))
+        metrics.STAGE_SECONDS.observe(loop.time() - finished_at, stage='download', **labels)
+        return [
+            ImageHandle(image_data, image['filename'],
+                        OutputRef(self.client.server_address, image['filename'], image['subfolder'], image['type']))
+            for image_data, image in zip(downloads, wanted)
+        ]
 
     async def close(self):
-        if self.ws:
-            await self.ws.close()
+        # As conexões são compartilhadas, quem fecha é o processo (get_comfy_pool().close())
+        pass
 
-# --- FUNÇÃO Txt2Img ---
-async def generate_images(prompt: str, negative_prompt: str, steps=25, cfg=7.0, sampler_name="dpmpp_2m", scheduler="karras", ckpt_name=None, status_callback=callback_time):
-    with open(text2img_config, 'r', encoding='utf-8') as file:
-      workflow = json.load(file)
-      
-    generator = ImageGenerator()
-    await generator.connect()
+ANIME_CLIP_SKIP_CKPT = "anime/ramthrustsNSFWPINK_alchemyMix176.safetensors"
 
-    # Leitura dos IDs do Config
-    section = 'LOCAL_TEXT2IMG'
-    
-    # 1. Prompts
-    # Tenta usar keys específicas se existirem, senão usa PROMPT_NODES
-    set_node_values(workflow, config.get(section, 'PROMPT_NODES', fallback=''), 'text', prompt) # Tenta 'text' ou 'string_b' automaticamente
-    clip_skip_nodes = config.get(section, 'CLIP_SKIP_NODES', fallback='')
-    
-   # CLIP SKIP 
-    if ckpt_name == "anime/ramthrustsNSFWPINK_alchemyMix176.safetensors":
+def new_seed():
+    return random.randint(1, 999999999999999)
+
+def apply_clip_skip(job, ckpt_name):
+    # CLIP SKIP 
+    if ckpt_name == ANIME_CLIP_SKIP_CKPT:
         # Força stop_at_last_layers = -1 (Clip Skip 1)
-        set_node_values(workflow, clip_skip_nodes, 'stop_at_last_layers', -1)
+        job.set('clip_skip', -1)
     else: 
-        set_node_values(workflow, clip_skip_nodes, 'stop_at_last_layers', -2)
-        
-    neg_nodes = config.get(section, 'NEG_PROMPT_NODES', fallback='')
-    if negative_prompt:
-        set_node_values(workflow, neg_nodes, 'text', negative_prompt)
-    else:
-        # Se não tiver negativo, limpa o campo (importante para string_b não ficar com lixo)
-        set_node_values(workflow, neg_nodes, 'text', "")
+        job.set('clip_skip', -2)
+
+# --- FUNÇÃO Txt2Img ---
+def build_txt2img_job(section, prompt, negative_prompt, steps, cfg, sampler_name, scheduler, ckpt_name, count=None):
+    job = TEMPLATES[section].new_job()
+
+    # 1. Prompts
+    job.set('prompt', prompt) # Tenta 'text' ou 'string_b' automaticamente
+    apply_clip_skip(job, ckpt_name)
+    # Se não tiver negativo, limpa o campo (importante para string_b não ficar com lixo)
+    job.set('negative_prompt', negative_prompt or "")
 
     # 2. Steps
-    set_node_values(workflow, config.get(section, 'STEPS_NODES', fallback=''), 'value', steps)
+    job.set('steps', steps)
 
-    # 3. CFG (flag is_string_number=True para forçar conversão para string se necessário)
-    set_node_values(workflow, config.get(section, 'CFG_NODES', fallback=''), 'Number', cfg, is_string_number=True)
+    # 3. CFG (convertido para string se necessário)
+    job.set('cfg', cfg)
 
     # 4. Checkpoint
     if ckpt_name:
-        set_node_values(workflow, config.get(section, 'CHECKPOINT_NODES', fallback=''), 'ckpt_name', ckpt_name)
+        job.set('checkpoint', ckpt_name)
 
     # 5. Sampler e Scheduler
     # KSampler geralmente tem inputs fixos 'sampler_name' e 'scheduler'
-    sampler_nodes = config.get(section, 'SAMPLER_NODES', fallback='').split(',')
-    for node in sampler_nodes:
-        if node.strip() in workflow:
-            workflow[node.strip()]['inputs']['sampler_name'] = sampler_name
-            workflow[node.strip()]['inputs']['scheduler'] = scheduler
+    job.set('sampler', sampler_name)
+    job.set('scheduler', scheduler)
 
     # 6. Seed
-    seed_nodes = config.get(section, 'RAND_SEED_NODES', fallback='')
-    set_node_values(workflow, seed_nodes, 'seed', random.randint(1, 999999999999999))
-
-    images = await generator.get_images(workflow, status_callback=status_callback)
-    await generator.close()
-    return images
-
-# --- FUNÇÃO Txt2Img PLUS---
-async def generate_images_plus(prompt: str, negative_prompt: str, steps=25, cfg=7.0, sampler_name="dpmpp_2m", scheduler="karras", ckpt_name=None, status_callback=callback_time):
-    # CORREÇÃO 1: Usa a variável do config PLUS, não a normal
-    with open(text2imgplus_config, 'r', encoding='utf-8') as file:
-      workflow = json.load(file)
-      
-    generator = ImageGenerator()
-    await generator.connect()
+    job.set('seed', new_seed())
 
-    # CORREÇÃO 2: Aponta para a seção nova do config.properties para ler os IDs certos
-    section = 'LOCAL_TEXT2IMG_PLUS'
-    
-    # 1. Prompts
-    set_node_values(workflow, config.get(section, 'PROMPT_NODES', fallback=''), 'text', prompt) 
-    clip_skip_nodes = config.get(section, 'CLIP_SKIP_NODES', fallback='')
-    
-   # CLIP SKIP 
-    if ckpt_name == "anime/ramthrustsNSFWPINK_alchemyMix176.safetensors":
-        set_node_values(workflow, clip_skip_nodes, 'stop_at_last_layers', -1)
-    else: 
-        set_node_values(workflow, clip_skip_nodes, 'stop_at_last_layers', -2)
-        
-    neg_nodes = config.get(section, 'NEG_PROMPT_NODES', fallback='')
-    if negative_prompt:
-        set_node_values(workflow, neg_nodes, 'text', negative_prompt)
-    else:
-        set_node_values(workflow, neg_nodes, 'text', "")
+    # 7. Quantidade: N imagens no mesmo latent, uma execução só (sem repetir CLIP e modelo)
+    if count:
+        job.set('batch_size', count)
 
-    # 2. Steps, CFG, Checkpoint, Seed
-    # Note que agora o 'config.get(section...)' vai ler da seção PLUS automaticamente
-    set_node_values(workflow, config.get(section, 'STEPS_NODES', fallback=''), 'value', steps)
-    set_node_values(workflow, config.get(section, 'CFG_NODES', fallback=''), 'Number', cfg, is_string_number=True)
+    jobTrace.annotate(workflow=section, checkpoint=ckpt_name, steps=steps, cfg=cfg, sampler=sampler_name,
+                      scheduler=scheduler, batch_size=count)
+    return job
 
-    if ckpt_name:
-        set_node_values(workflow, config.get(section, 'CHECKPOINT_NODES', fallback=''), 'ckpt_name', ckpt_name)
+async def generate_images(prompt: str, negative_prompt: str, steps=25, cfg=7.0, sampler_name="dpmpp_2m", scheduler="karras", ckpt_name=None, status_callback=callback_time, count=None):
+    with jobTrace.span('workflow_build'):
+        job = build_txt2img_job('LOCAL_TEXT2IMG', prompt, negative_prompt, steps, cfg, sampler_name, scheduler, ckpt_name, count)
 
-    # 5. Sampler e Scheduler
-    sampler_nodes = config.get(section, 'SAMPLER_NODES', fallback='').split(',')
-    for node in sampler_nodes:
-        if node.strip() in workflow:
-            workflow[node.strip()]['inputs']['sampler_name'] = sampler_name
-            workflow[node.strip()]['inputs']['scheduler'] = scheduler
+    generator = ImageGenerator()
+    images = await generator.get_images(job.workflow, status_callback=status_callback, output_nodes=job.template.output_nodes, ckpt_name=ckpt_name)
+    await generator.close()
+    return images
 
-    # 6. Seed
-    seed_nodes = config.get(section, 'RAND_SEED_NODES', fallback='')
-    set_node_values(workflow, seed_nodes, 'seed', random.randint(1, 999999999999999))
+# --- FUNÇÃO Txt2Img PLUS---
+async def generate_images_plus(prompt: str, negative_prompt: str, steps=25, cfg=7.0, sampler_name="dpmpp_2m", scheduler="karras", ckpt_name=None, status_callback=callback_time, count=None):
+    # Mesmo preenchimento do normal, mas com o workflow e os IDs da seção PLUS
+    with jobTrace.span('workflow_build'):
+        job = build_txt2img_job('LOCAL_TEXT2IMG_PLUS', prompt, negative_prompt, steps, cfg, sampler_name, scheduler, ckpt_name, count)
 
-    images = await generator.get_images(workflow, status_callback=status_callback)
+    generator = ImageGenerator()
+    images = await generator.get_images(job.workflow, status_callback=status_callback, output_nodes=job.template.output_nodes, ckpt_name=ckpt_name)
     await generator.close()
 
     return images
 
 # --- FUNÇÃO Img2Img ---
-async def generate_alternatives(image: Image.Image, prompt: str, negative_prompt: str, steps=None, cfg=None, sampler_name=None, scheduler=None, ckpt_name=None, status_callback=callback_time):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-      image.save(temp_file, format="PNG")
-      temp_filepath = temp_file.name
-
-    response_data = upload_image(temp_filepath)
-    filename = response_data['name']
-    
-    with open(img2img_config, 'r', encoding='utf-8') as file:
-      workflow = json.load(file)
-      
-    generator = ImageGenerator()
-    await generator.connect()
-    
-    section = 'LOCAL_IMG2IMG'
+async def generate_alternatives(image: ImageHandle, prompt: str, negative_prompt: str, steps=None, cfg=None, sampler_name=None, scheduler=None, ckpt_name=None, status_callback=callback_time):
+    build_started = time.monotonic()
+    job = TEMPLATES['LOCAL_IMG2IMG'].new_job()
 
-    # 1. Inputs Básicos
-    set_node_values(workflow, config.get(section, 'PROMPT_NODES', fallback=''), 'text', prompt)
-    set_node_values(workflow, config.get(section, 'NEG_PROMPT_NODES', fallback=''), 'text', negative_prompt)
-    set_node_values(workflow, config.get(section, 'RAND_SEED_NODES', fallback=''), 'seed', random.randint(1, 999999999999999))
-    set_node_values(workflow, config.get(section, 'FILE_INPUT_NODES', fallback=''), 'image', filename)
+    # 1. Inputs Básicos (a imagem é enviada depois, para o servidor que for rodar o job)
+    job.set('prompt', prompt)
+    job.set('negative_prompt', negative_prompt or "")
+    job.set('seed', new_seed())
 
     # 2. Checkpoint e Clip Skip
     if ckpt_name:
-        set_node_values(workflow, config.get(section, 'CHECKPOINT_NODES', fallback=''), 'ckpt_name', ckpt_name)
-        
-    clip_skip_nodes = config.get(section, 'CLIP_SKIP_NODES', fallback='')
-    if ckpt_name == "anime/ramthrustsNSFWPINK_alchemyMix176.safetensors":
-        set_node_values(workflow, clip_skip_nodes, 'stop_at_last_layers', -1)
-    else: 
-        set_node_values(workflow, clip_skip_nodes, 'stop_at_last_layers', -2)
+        job.set('checkpoint', ckpt_name)
+    apply_clip_skip(job, ckpt_name)
 
-    # 3. Steps e CFG (VOLTAMOS PARA O MODO PRIMITIVE)
+    # 3. Steps e CFG (nós primitivos usam 'value', o nó Float usa 'Number')
     if steps:
-        # Passamos 'value' porque nós primitivos usam esse campo
-        set_node_values(workflow, config.get(section, 'STEPS_NODES', fallback=''), 'value', steps)
-        
+        job.set('steps', steps)
     if cfg:
-        # Passamos 'Number' ou 'value'. Sua função set_node_values é inteligente e tenta 'value' se 'Number' falhar.
-        # Use 'Number' se for aquele nó "Float" específico, ou 'value' se for Primitive Node.
-        # Vou deixar 'Number' com is_string_number=True por segurança, mas sua função trata.
-        set_node_values(workflow, config.get(section, 'CFG_NODES', fallback=''), 'Number', cfg, is_string_number=True)
+        job.set('cfg', cfg)
         
     # 4. Sampler e Scheduler (Continua injetando direto no KSampler)
     if sampler_name and scheduler:
-        sampler_nodes = config.get(section, 'SAMPLER_NODES', fallback='').split(',')
-        for node in sampler_nodes:
-            if node.strip() in workflow:
-                workflow[node.strip()]['inputs']['sampler_name'] = sampler_name
-                workflow[node.strip()]['inputs']['scheduler'] = scheduler
+        job.set('sampler', sampler_name)
+        job.set('scheduler', scheduler)
 
-    images = await generator.get_images(workflow)
+    jobTrace.add_span('workflow_build', build_started, time.monotonic())
+    jobTrace.annotate(workflow='LOCAL_IMG2IMG', checkpoint=ckpt_name, steps=steps, cfg=cfg, sampler=sampler_name, scheduler=scheduler)
+    generator = ImageGenerator()
+    images = await generator.get_images(job.workflow, status_callback=status_callback, output_nodes=job.template.output_nodes, ckpt_name=ckpt_name, prepare=input_image_binder(job, image), prefer_server=image.ref and image.ref.server_address)
     await generator.close()
 
     return images
 
 # --- FUNÇÃO Upscale ---
-async def upscale_image(image: Image.Image, prompt: str, negative_prompt: str, ckpt_name=None, status_callback=callback_time):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-      image.save(temp_file, format="PNG")
-      temp_filepath = temp_file.name
-
-    response_data = upload_image(temp_filepath)
-    filename = response_data['name']
-    
-    with open(upscale_config, 'r', encoding='utf-8') as file:
-      workflow = json.load(file)
+async def upscale_image(image: ImageHandle, prompt: str, negative_prompt: str, ckpt_name=None, status_callback=callback_time):
+    build_started = time.monotonic()
+    job = TEMPLATES['LOCAL_UPSCALE'].new_job()
 
-    generator = ImageGenerator()
-    await generator.connect()
-
-    section = 'LOCAL_UPSCALE'
-
-    # 1. Inputs Básicos
-    set_node_values(workflow, config.get(section, 'PROMPT_NODES', fallback=''), 'text', prompt)
-    set_node_values(workflow, config.get(section, 'NEG_PROMPT_NODES', fallback=''), 'text', negative_prompt)
-    set_node_values(workflow, config.get(section, 'RAND_SEED_NODES', fallback=''), 'seed', random.randint(1, 999999999999999))
-    set_node_values(workflow, config.get(section, 'FILE_INPUT_NODES', fallback=''), 'image', filename)
+    # 1. Inputs Básicos (Prompt, Negativo, Seed; a imagem vai para o servidor escolhido)
+    job.set('prompt', prompt)
+    job.set('negative_prompt', negative_prompt or "")
+    job.set('seed', new_seed())
 
     # 2. Checkpoint Principal
     if ckpt_name:
-        set_node_values(workflow, config.get(section, 'CHECKPOINT_NODES', fallback=''), 'ckpt_name', ckpt_name)
-
-    # 1. Inputs Básicos (Prompt, Negativo, Seed, Imagem)
-    clip_skip_nodes = config.get(section, 'CLIP_SKIP_NODES', fallback='')
-    
-    # CLIP SKIP 
-    if ckpt_name == "anime/ramthrustsNSFWPINK_alchemyMix176.safetensors":
-        # Força stop_at_last_layers = -1 (Clip Skip 1)
-        set_node_values(workflow, clip_skip_nodes, 'stop_at_last_layers', -1)
-    else: 
-        set_node_values(workflow, clip_skip_nodes, 'stop_at_last_layers', -2)
+        job.set('checkpoint', ckpt_name)
+    apply_clip_skip(job, ckpt_name)
     
     upscaleModel = upscalePeople
     if "anime" in ckpt_name:
@@ -438,25 +544,30 @@ async def upscale_image(image: Image.Image, prompt: str, negative_prompt: str, c
 
     # 3. Forçar Modelo de Upscale
     # Adicione UPSCALE_MODEL_NODES=[ID] no seu config na seção LOCAL_UPSCALE
-    upscale_model_nodes = config.get(section, 'UPSCALE_MODEL_NODES', fallback='')
-    if upscale_model_nodes:
-        set_node_values(workflow, upscale_model_nodes, 'model_name', upscaleModel)
+    job.set('upscale_model', upscaleModel)
         
     ancestral_samplers = ["euler_ancestral", "dpmpp_2s_ancestral", "dpmpp_sde", "dpmpp_2m_sde", "dpmpp_3m_sde"]
     ultimate_upscale_node = "6"
-    current_sampler = workflow[ultimate_upscale_node]['inputs'].get('sampler_name', 'dpmpp_2m')
+    ultimate_inputs = job.inputs(ultimate_upscale_node)
+    current_sampler = ultimate_inputs.get('sampler_name', 'dpmpp_2m')
     
     if current_sampler in ancestral_samplers:
         # Se for Ancestral, ativa o Band Pass para esconder as linhas
-        workflow[ultimate_upscale_node]['inputs']['seam_fix_mode'] = "Band Pass"
-        workflow[ultimate_upscale_node]['inputs']['seam_fix_denoise'] = 0.2 # Um leve blur na emenda
+        ultimate_inputs['seam_fix_mode'] = "Band Pass"
+        ultimate_inputs['seam_fix_denoise'] = 0.2 # Um leve blur na emenda
         # print(f"DEBUG: Seam Fix ATIVADO para {current_sampler}")
     else:
         # Se for dpmpp_2m ou Euler normal, desliga para ganhar performance e nitidez
-        workflow[ultimate_upscale_node]['inputs']['seam_fix_mode'] = "None"
+        ultimate_inputs['seam_fix_mode'] = "None"
         # print(f"DEBUG: Seam Fix DESLIGADO para {current_sampler}")
 
-    images = await generator.get_images(workflow, status_callback=status_callback)
+    jobTrace.add_span('workflow_build', build_started, time.monotonic())
+    jobTrace.annotate(workflow='LOCAL_UPSCALE', checkpoint=ckpt_name, sampler=current_sampler,
+                      steps=ultimate_inputs.get('steps'), upscale_model=upscaleModel)
+    generator = ImageGenerator()
+    images = await generator.get_images(job.workflow, status_callback=status_callback, output_nodes=job.template.output_nodes, ckpt_name=ckpt_name, prepare=input_image_binder(job, image), prefer_server=image.ref and image.ref.server_address)
     await generator.close()
 
-    return images[0]
\ No newline at end of file
+    if not images:
+        raise ComfyError("O ComfyUI não retornou a imagem do upscale")
+    return images[0]
@@ -0,0 +1,75 @@
+import hashlib
+import os
+from collections import namedtuple
+from io import BytesIO
+
+from PIL import Image
+
+
+class OutputRef(namedtuple('OutputRef', 'server_address filename subfolder folder_type')):
+    """Onde a imagem ficou salva no ComfyUI que a gerou (o que o /history informou)."""
+    __slots__ = ()
+
+    @property
+    def load_name(self):
+        # O LoadImage aceita "sub/arquivo.png [output]" e lê direto da pasta output/ (ou temp/)
+        path = f"{self.subfolder}/{self.filename}" if self.subfolder else self.filename
+        return f"{path} [{self.folder_type}]"
+
+
+class ImageHandle:
+    """
+    Imagem exatamente como veio do ComfyUI (bytes PNG/WebP/JPEG originais).
+    Os pixels só são decodificados quando alguém realmente precisa (colagem, resize);
+    extrair a imagem ou mandar para o Discord usa os bytes originais, sem re-codificar.
+    """
+
+    def __init__(self, data: bytes, filename="image.png", ref: OutputRef = None):
+        self.data = data
+        self.filename = filename
+        # Com ref, variação/upscale no mesmo servidor usam o arquivo que já está lá, sem upload
+        self.ref = ref
+        self._size = None
+        self._content_hash = None
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.filename)[1].lower() or ".png"
+
+    @property
+    def size(self):
+        # Image.open só lê o cabeçalho, não decodifica os pixels
+        if self._size is None:
+            with Image.open(BytesIO(self.data)) as image:
+                self._size = image.size
+        return self._size
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self.data).hexdigest()
+        return self._content_hash
+
+    def decode(self) -> Image.Image:
+        """Decodifica os pixels. Não fica em cache: quem chamou decide quanto tempo manter."""
+        image = Image.open(BytesIO(self.data))
+        image.load()
+        return image
+
+    def open(self):
+        """Arquivo em memória com os bytes originais (para discord.File, upload, etc)."""
+        return BytesIO(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"<ImageHandle {self.filename} {len(self.data)} bytes>"
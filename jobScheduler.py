@@ -0,0 +1,152 @@
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+
+
+class _Ticket:
+    def __init__(self, user_id, guild_id, kind, cost, seq):
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.kind = kind
+        self.cost = cost
+        self.seq = seq
+        self.expensive = cost > 1
+        self.granted = False
+        self.position = None
+        self.changed = asyncio.Event()
+
+
+class FairScheduler:
+    """
+    Fila do próprio bot, na frente do ComfyUI.
+
+    Os jobs esperam aqui e só são liberados para o ComfyUI até max_in_flight de cada vez,
+    então o FIFO do servidor nunca fica cheio de jobs de uma pessoa só. Na hora de liberar:
+    - limite de jobs em andamento por usuário (max_per_user) e por servidor do Discord (max_per_guild);
+    - jobs baratos (/gerar, variações) passam na frente dos caros (upscale, /genplus), mas depois
+      de cheap_burst baratos seguidos um caro que esteja esperando ganha a vez;
+    - entre usuários é um round-robin ponderado: vai quem consumiu menos custo até agora
+      (job caro custa expensive_cost). Quem chega agora entra no nível de quem já está
+      esperando, sem crédito acumulado.
+    """
+
+    def __init__(self, max_in_flight=2, max_per_user=1, max_per_guild=3,
+                 expensive_kinds=(), expensive_cost=3, cheap_burst=4):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.max_per_guild = max_per_guild
+        self.expensive_kinds = set(expensive_kinds)
+        self.expensive_cost = expensive_cost
+        self.cheap_burst = cheap_burst
+        self._waiting = []
+        self._served = {}            # usuário -> custo já liberado (só de quem está ativo)
+        self._user_running = Counter()
+        self._guild_running = Counter()
+        self._running = 0
+        self._cheap_streak = 0
+        self._seq = 0
+
+    @asynccontextmanager
+    async def slot(self, user_id, guild_id, kind, on_position=None):
+        """
+        Espera a vez do job e segura a vaga até o bloco terminar.
+        on_position(posição) é awaited sempre que a posição na espera mudar.
+        """
+        ticket = await self.acquire(user_id, guild_id, kind, on_position)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    async def acquire(self, user_id, guild_id, kind, on_position=None):
+        cost = self.expensive_cost if kind in self.expensive_kinds else 1
+        self._seq += 1
+        ticket = _Ticket(user_id, guild_id, kind, cost, self._seq)
+        if not self._is_active(user_id):
+            # Sem crédito guardado: entra no nível de quem já está na fila
+            active = [self._served[u] for u in self._served]
+            self._served[user_id] = min(active) if active else 0
+        self._waiting.append(ticket)
+        self._pump()
+
+        try:
+            while not ticket.granted:
+                await ticket.changed.wait()
+                ticket.changed.clear()
+                if not ticket.granted and on_position is not None:
+                    await on_position(ticket.position)
+        except BaseException:
+            # Interação cancelada enquanto esperava (ou já liberado: devolve a vaga)
+            if ticket.granted:
+                self.release(ticket)
+            else:
+                self._waiting.remove(ticket)
+                self._forget_if_idle(user_id)
+                self._pump()
+            raise
+        return ticket
+
+    def release(self, ticket):
+        self._running -= 1
+        self._user_running[ticket.user_id] -= 1
+        if self._user_running[ticket.user_id] <= 0:
+            del self._user_running[ticket.user_id]
+        if ticket.guild_id is not None:
+            self._guild_running[ticket.guild_id] -= 1
+            if self._guild_running[ticket.guild_id] <= 0:
+                del self._guild_running[ticket.guild_id]
+        self._forget_if_idle(ticket.user_id)
+        self._pump()
+
+    def stats(self):
+        return {
+            'running': self._running,
+            'waiting': len(self._waiting),
+            'users': len(self._served),
+        }
+
+    # --- ESCOLHA ---
+    def _is_active(self, user_id):
+        return user_id in self._user_running or any(t.user_id == user_id for t in self._waiting)
+
+    def _forget_if_idle(self, user_id):
+        if not self._is_active(user_id):
+            self._served.pop(user_id, None)
+
+    def _can_run(self, ticket):
+        if self._user_running[ticket.user_id] >= self.max_per_user:
+            return False
+        if ticket.guild_id is not None and self._guild_running[ticket.guild_id] >= self.max_per_guild:
+            return False
+        return True
+
+    def _order(self, ticket):
+        # Depois de uma sequência de baratos, os caros passam a ter prioridade
+        expensive_first = self.cheap_burst and self._cheap_streak >= self.cheap_burst
+        rank = ticket.expensive != expensive_first
+        return (rank, self._served[ticket.user_id], ticket.seq)
+
+    def _pump(self):
+        while self._running < self.max_in_flight:
+            ready = [t for t in self._waiting if self._can_run(t)]
+            if not ready:
+                break
+            ticket = min(ready, key=self._order)
+            self._waiting.remove(ticket)
+
+            self._running += 1
+            self._user_running[ticket.user_id] += 1
+            if ticket.guild_id is not None:
+                self._guild_running[ticket.guild_id] += 1
+            self._served[ticket.user_id] += ticket.cost
+            self._cheap_streak = 0 if ticket.expensive else self._cheap_streak + 1
+
+            ticket.granted = True
+            ticket.changed.set()
+        self._publish()
+
+    def _publish(self):
+        for position, ticket in enumerate(sorted(self._waiting, key=self._order), start=1):
+            if ticket.position != position:
+                ticket.position = position
+                ticket.changed.set()
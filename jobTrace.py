@@ -0,0 +1,143 @@
+import asyncio
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Trace do job atual. As tasks criadas dentro do job herdam o contexto, então os spans do
+# imageGen caem no trace de quem pediu (no single-flight e no lote, no de quem abriu o job).
+CURRENT = contextvars.ContextVar('job_trace', default=None)
+
+_logger = logging.getLogger('sdxlbot.trace')
+_logger.propagate = False
+_listener = None
+
+
+def configure(path, max_bytes=10 * 1024 * 1024, backup_count=5):
+    """
+    Liga o trace: um registro JSON por linha em path, com rotação por tamanho.
+    O handler só põe o registro numa fila em memória; quem escreve no disco é a thread
+    do QueueListener, então o event loop nunca espera o arquivo.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.SimpleQueue()
+    _logger.addHandler(QueueHandler(records))
+    _logger.setLevel(logging.INFO)
+    _listener = QueueListener(records, file_handler)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """Grava o que ainda está na fila e para a thread de escrita."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def enabled():
+    return _listener is not None
+
+
+class JobTrace:
+    """
+    Spans de um job: nome, início relativo ao começo do job e duração, em ms.
+    Os tempos usam o relógio monotônico (o mesmo do loop.time() do asyncio), então
+    quem já tem os instantes do loop pode registrar o span com add_span.
+    """
+
+    def __init__(self, command, received_ago=0.0, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.command = command
+        self.attrs = {}
+        self.annotate(**attrs)
+        self.spans = []
+        now = time.monotonic()
+        # O job começa quando o Discord criou a interação, não quando o handler rodou
+        self.started = now - received_ago
+        self.wall_started = time.time() - received_ago
+        if received_ago:
+            self.add_span('receipt', self.started, now)
+
+    def annotate(self, **attrs):
+        self.attrs.update((key, value) for key, value in attrs.items() if value is not None)
+
+    def add_span(self, name, start, end, **attrs):
+        span = {'name': name, 'start_ms': round((start - self.started) * 1000, 1), 'ms': round((end - start) * 1000, 1)}
+        span.update((key, value) for key, value in attrs.items() if value is not None)
+        self.spans.append(span)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.monotonic(), **attrs)
+
+    def finish(self):
+        record = {
+            'trace_id': self.trace_id,
+            'time': datetime.fromtimestamp(self.wall_started, timezone.utc).isoformat(timespec='milliseconds'),
+            'command': self.command,
+            'result': 'ok',
+            **self.attrs,
+            'total_ms': round((time.monotonic() - self.started) * 1000, 1),
+            'spans': self.spans,
+        }
+        _logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def job(command, received_ago=0.0, **attrs):
+    """Abre o trace do job no contexto atual e grava o registro no fim (nada, se o trace estiver desligado)."""
+    if not enabled():
+        yield None
+        return
+    trace = JobTrace(command, received_ago, **attrs)
+    token = CURRENT.set(trace)
+    try:
+        yield trace
+    except asyncio.CancelledError:
+        trace.annotate(result='cancelled')
+        raise
+    except Exception as e:
+        trace.annotate(result='error', error=repr(e))
+        raise
+    finally:
+        CURRENT.reset(token)
+        trace.finish()
+
+
+# Atalhos para o trace do contexto atual: sem job aberto, não fazem nada
+
+def annotate(**attrs):
+    trace = CURRENT.get()
+    if trace is not None:
+        trace.annotate(**attrs)
+
+
+def add_span(name, start, end, **attrs):
+    trace = CURRENT.get()
+    if trace is not None:
+        trace.add_span(name, start, end, **attrs)
+
+
+def span(name, **attrs):
+    trace = CURRENT.get()
+    return trace.span(name, **attrs) if trace is not None else nullcontext()
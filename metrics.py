@@ -0,0 +1,146 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# Comando e checkpoint do job atual, para rotular as métricas sem passar isso por todas as funções.
+# Tasks criadas dentro do job (single-flight, lote, fila) herdam o contexto de quem as criou.
+JOB_CONTEXT = contextvars.ContextVar('job_context', default={})
+
+# Segundos: de uma leitura rápida de /history até um upscale longo
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for key, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # rótulos -> [contagem por bucket, soma, total]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][index] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for key, (counts, total_sum, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total_sum}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """collect() devolve [(nome, tipo, ajuda, valor)]: valores lidos na hora (ex: stats() de outros módulos)."""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, metric_type, documentation, value in collect():
+                lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'sdxlbot_stage_seconds', 'Tempo de cada etapa de um job', ('stage', 'command', 'checkpoint')))
+NODE_SECONDS = REGISTRY.register(Histogram(
+    'sdxlbot_comfy_node_seconds', 'Tempo de execução de cada nó no ComfyUI, pelo evento executing',
+    ('node_class', 'command', 'checkpoint')))
+JOBS = REGISTRY.register(Counter(
+    'sdxlbot_jobs_total', 'Jobs terminados por resultado (ok, error, cancelled)', ('command', 'checkpoint', 'result')))
+CACHED_NODES = REGISTRY.register(Counter(
+    'sdxlbot_comfy_cached_nodes_total', 'Nós que o ComfyUI pulou por já estarem em cache (execution_cached)',
+    ('command', 'checkpoint')))
+
+
+def job_labels(**overrides):
+    context = JOB_CONTEXT.get()
+    labels = {'command': context.get('command', '-'), 'checkpoint': context.get('checkpoint') or '-'}
+    labels.update(overrides)
+    return labels
+
+
+def observe_stage(stage, seconds, **overrides):
+    STAGE_SECONDS.observe(seconds, **job_labels(stage=stage, **overrides))
+
+
+@contextmanager
+def timed(stage, **overrides):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, **overrides)
+
+
+async def start_server(host='127.0.0.1', port=9464):
+    """Sobe o /metrics (formato texto do Prometheus) no event loop atual."""
+    async def handle(request):
+        return web.Response(body=REGISTRY.render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Métricas em http://{host}:{port}/metrics")
+    return runner
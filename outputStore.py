@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+INDEX_FILE = 'index.json'
+# Extensões dos arquivos do layout antigo que são migrados (o resto da raiz não é mexido)
+LEGACY_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+class OutputStore:
+    """
+    Pasta de saída (./out) endereçada pelo conteúdo.
+
+    Cada imagem vira out/<2 primeiros do hash>/<sha256><extensão>: salvar a mesma imagem de
+    novo não grava nada, e dois saves no mesmo segundo nunca colidem.
+    A gravação é atômica (arquivo temporário + os.replace). O index.json guarda tamanho,
+    criação e último uso de cada arquivo, para a limpeza não precisar varrer a pasta:
+    - max_bytes: acima disso, os menos usados recentemente são apagados;
+    - max_age: arquivos sem uso há mais que isso (segundos) são apagados.
+    0 desliga o limite. Arquivos soltos na raiz (layout antigo: collage_<data>.png,
+    img_<data>_N.png) são movidos para o layout por hash na primeira carga, e passam a contar
+    nos limites. O index é regravado quando entra ou sai um arquivo; só o último uso
+    mudou (mesma imagem de novo), ele espera até index_save_interval segundos ou o flush().
+    Os métodos bloqueiam (disco): no bot, chame via asyncio.to_thread.
+    """
+
+    def __init__(self, root='./out', max_bytes=0, max_age=0, age_check_interval=3600, index_save_interval=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.age_check_interval = age_check_interval
+        self.index_save_interval = index_save_interval
+        self._lock = threading.Lock()
+        self._index = None
+        self._total = 0
+        self._last_age_check = 0.0
+        self._dirty = False
+        self._last_save = 0.0
+
+    def put(self, data, extension='.png', kind=''):
+        """Guarda os bytes e devolve o caminho do arquivo."""
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._load()
+            now = time.time()
+            entry = self._index.get(content_hash)
+            path = self._path(content_hash, entry['ext'] if entry else extension)
+            if entry is not None and os.path.exists(path):
+                entry['used'] = now
+                changed = False
+            else:
+                self._write_atomic(path, data)
+                if entry is not None:
+                    self._total -= entry['size']
+                self._index[content_hash] = {'ext': extension, 'size': len(data), 'created': now, 'used': now, 'kind': kind}
+                self._total += len(data)
+                changed = True
+            changed = self._evict(now, keep=content_hash) or changed
+            self._dirty = True
+            if changed or now - self._last_save >= self.index_save_interval:
+                self._save_index(now)
+            return path
+
+    def flush(self):
+        """Grava o index se algum último uso ainda não foi salvo (chame ao encerrar)."""
+        with self._lock:
+            if self._dirty:
+                self._save_index(time.time())
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {'files': len(self._index), 'bytes': self._total}
+
+    # --- DISCO ---
+    def _path(self, content_hash, extension):
+        return os.path.join(self.root, content_hash[:2], content_hash + extension)
+
+    def _write_atomic(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _load(self):
+        if self._index is not None:
+            return
+        try:
+            with open(os.path.join(self.root, INDEX_FILE), 'r', encoding='utf-8') as file:
+                self._index = json.load(file)
+        except (OSError, ValueError):
+            self._index = self._rebuild_index()
+        migrated = self._migrate_legacy()
+        self._total = sum(entry['size'] for entry in self._index.values())
+        if migrated:
+            print(f"Pasta de saída: {migrated} arquivos do layout antigo movidos para {self.root}/<hash>")
+            self._save_index(time.time())
+
+    def _rebuild_index(self):
+        # Sem index (primeira vez ou arquivo corrompido): reconstrói pelo que está na pasta
+        index = {}
+        if not os.path.isdir(self.root):
+            return index
+        for shard in os.listdir(self.root):
+            shard_path = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_path):
+                continue
+            for name in os.listdir(shard_path):
+                content_hash, extension = os.path.splitext(name)
+                if extension == '.tmp' or not content_hash.startswith(shard):
+                    continue
+                info = os.stat(os.path.join(shard_path, name))
+                index[content_hash] = {'ext': extension, 'size': info.st_size, 'created': info.st_mtime, 'used': info.st_mtime, 'kind': ''}
+        return index
+
+    def _migrate_legacy(self):
+        # Só a raiz: os shards de 2 caracteres já são do layout novo
+        if not os.path.isdir(self.root):
+            return 0
+        migrated = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            extension = os.path.splitext(name)[1]
+            if extension.lower() not in LEGACY_EXTENSIONS or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as file:
+                content_hash = hashlib.sha256(file.read()).hexdigest()
+            info = os.stat(path)
+            target = self._path(content_hash, extension)
+            if content_hash in self._index and os.path.exists(self._path(content_hash, self._index[content_hash]['ext'])):
+                os.remove(path)  # cópia de uma imagem que já está na pasta
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+                kind = name.split('_', 1)[0] if '_' in name else ''
+                self._index[content_hash] = {'ext': extension, 'size': info.st_size, 'created': info.st_mtime,
+                                             'used': info.st_mtime, 'kind': kind}
+            migrated += 1
+        return migrated
+
+    def _save_index(self, now):
+        os.makedirs(self.root, exist_ok=True)
+        self._write_atomic(os.path.join(self.root, INDEX_FILE), json.dumps(self._index).encode('utf-8'))
+        self._dirty = False
+        self._last_save = now
+
+    # --- LIMPEZA ---
+    def _evict(self, now, keep=None):
+        """Apaga o que passou dos limites; devolve True se algum arquivo saiu."""
+        removed = False
+        expired = []
+        if self.max_age and now - self._last_age_check >= self.age_check_interval:
+            self._last_age_check = now
+            expired = [h for h, entry in self._index.items() if now - entry['used'] > self.max_age and h != keep]
+        for content_hash in expired:
+            self._remove(content_hash)
+            removed = True
+
+        if self.max_bytes and self._total > self.max_bytes:
+            for content_hash, _ in sorted(self._index.items(), key=lambda item: item[1]['used']):
+                if self._total <= self.max_bytes:
+                    break
+                if content_hash != keep:
+                    self._remove(content_hash)
+                    removed = True
+        return removed
+
+    def _remove(self, content_hash):
+        entry = self._index.pop(content_hash)
+        self._total -= entry['size']
+        try:
+            os.remove(self._path(content_hash, entry['ext']))
+        except OSError:
+            pass
@@ -0,0 +1,165 @@
+import asyncio
+import bisect
+
+
+class QueueTracker:
+    """
+    Posição na fila de todos os jobs deste bot, compartilhada por um ComfyClient.
+
+    Os eventos do websocket movem a fila localmente, sem HTTP:
+    - execution_start: o prompt começou, quem estava antes dele já saiu;
+    - executing(None) / execution_success / erro: o prompt terminou.
+    O evento 'status' traz o tamanho da fila no servidor (queue_remaining); se não
+    bater com a conta local (ex: alguém usando a interface web), o /queue é relido.
+    Esse snapshot é único para todos os jobs e tem TTL, então uma rajada de
+    /gerar não vira uma rajada de /queue.
+
+    Cada mudança de posição vira uma mensagem 'queue_position' na fila do job.
+    """
+
+    def __init__(self, client, snapshot_ttl=2.0):
+        self.client = client
+        self.snapshot_ttl = snapshot_ttl
+        self._pending = []       # [(número na fila, prompt_id)] em ordem
+        self._running = set()
+        self._tracked = {}       # prompt_id -> última posição enviada (None = nada enviado)
+        self._snapshot_time = None
+        self._dirty = False
+        self._refresh_task = None
+        self._closed = False
+
+    async def close(self):
+        """Cancela a releitura pendente do /queue (senão ela abriria outra sessão HTTP depois do close)."""
+        self._closed = True
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    # --- JOBS ---
+    def track(self, prompt_id, number):
+        """Começa a acompanhar um prompt recém enviado (number vem da resposta do /prompt)."""
+        self._tracked[prompt_id] = None
+        if prompt_id not in self._running and all(p != prompt_id for _, p in self._pending):
+            bisect.insort(self._pending, (number, prompt_id))
+        if self._snapshot_fresh():
+            self._publish()
+        else:
+            self.request_refresh()
+
+    def untrack(self, prompt_id):
+        self._tracked.pop(prompt_id, None)
+
+    def forget(self, prompt_id):
+        """Tira da conta local um prompt que o servidor não tem mais (ex: ComfyUI reiniciado)."""
+        self.untrack(prompt_id)
+        self._running.discard(prompt_id)
+        self._pending = [(n, p) for n, p in self._pending if p != prompt_id]
+        self._publish()
+
+    # --- EVENTOS DO WEBSOCKET ---
+    def on_message(self, message):
+        message_type = message.get('type')
+        data = message.get('data') or {}
+
+        if message_type == 'status':
+            exec_info = (data.get('status') or {}).get('exec_info') or {}
+            remaining = exec_info.get('queue_remaining')
+            if remaining is not None and remaining != self.depth:
+                self.request_refresh()
+
+        elif message_type == 'execution_start':
+            self._started(data.get('prompt_id'))
+
+        elif message_type in ('execution_success', 'execution_error', 'execution_interrupted'):
+            self._running.discard(data.get('prompt_id'))
+
+        elif message_type == 'executing' and data.get('node') is None:
+            self._running.discard(data.get('prompt_id'))
+
+    def _started(self, prompt_id):
+        number = next((n for n, p in self._pending if p == prompt_id), None)
+        self._running = {prompt_id}
+        if number is None:
+            # Prompt que não conhecíamos: só o /queue sabe onde a fila está
+            self.request_refresh()
+            return
+        # Fila é FIFO pelo número: tudo antes (e ele mesmo) já saiu da espera
+        self._pending = [(n, p) for n, p in self._pending if n > number]
+        self._publish()
+
+    # --- SNAPSHOT DO /queue ---
+    def _snapshot_fresh(self):
+        if self._snapshot_time is None:
+            return False
+        return asyncio.get_running_loop().time() - self._snapshot_time < self.snapshot_ttl
+
+    def request_refresh(self):
+        if self._closed:
+            return
+        self._dirty = True
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        loop = asyncio.get_running_loop()
+        while self._dirty:
+            if self._snapshot_time is not None:
+                wait = self._snapshot_time + self.snapshot_ttl - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            self._dirty = False
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Erro ao ler fila: {e}")
+                self._snapshot_time = loop.time()
+
+    async def refresh(self):
+        """Relê o /queue agora (levanta exceção se o servidor não responder)."""
+        data = await self.client.get_queue_info(raise_errors=True)
+        self._snapshot_time = asyncio.get_running_loop().time()
+        self._apply_snapshot(data)
+
+    def _apply_snapshot(self, data):
+        running = {task[1] for task in data.get('queue_running', [])}
+        pending = sorted((task[0], task[1]) for task in data.get('queue_pending', []))
+        known = running.union(p for _, p in pending)
+
+        # Nossos prompts enviados depois do snapshot ser tirado ainda não aparecem nele
+        last_number = pending[-1][0] if pending else None
+        for number, prompt_id in self._pending:
+            if prompt_id in self._tracked and prompt_id not in known and (last_number is None or number > last_number):
+                pending.append((number, prompt_id))
+
+        self._running = running
+        self._pending = sorted(pending)
+        self._publish()
+
+    @property
+    def depth(self):
+        """Quantos prompts o servidor tem (rodando + esperando), pela conta local."""
+        return len(self._running) + len(self._pending)
+
+    # --- AVISOS PARA OS JOBS ---
+    def position(self, prompt_id):
+        """0 = executando, N = posição na espera (contando quem está rodando), None = desconhecido."""
+        if prompt_id in self._running:
+            return 0
+        for index, (_, pending_id) in enumerate(self._pending):
+            if pending_id == prompt_id:
+                return len(self._running) + index + 1
+        return None
+
+    def _publish(self):
+        running_count = len(self._running)
+        positions = {prompt_id: 0 for prompt_id in self._running}
+        for index, (_, prompt_id) in enumerate(self._pending):
+            positions[prompt_id] = running_count + index + 1
+
+        for prompt_id, last_position in self._tracked.items():
+            position = positions.get(prompt_id)
+            if position is None or position == last_position:
+                continue
+            self._tracked[prompt_id] = position
+            self.client.deliver(prompt_id, {'type': 'queue_position', 'data': {'prompt_id': prompt_id, 'position': position}})
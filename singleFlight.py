@@ -0,0 +1,128 @@
+import asyncio
+
+
+class _Flight:
+    def __init__(self):
+        self.task = None
+        self.waiters = 0
+        self.callbacks = []
+        self.last_status = None
+
+
+class SingleFlight:
+    """
+    Junta pedidos idênticos que chegam enquanto o primeiro ainda está rodando.
+
+    do(chave, func, status_callback) roda func(status) só se não houver outro com a mesma
+    chave em andamento; se houver, espera o mesmo resultado (ou a mesma exceção).
+    O status do job é repassado para o status_callback de todos que estão esperando.
+    O job só é cancelado se todos os interessados desistirem.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.started = 0
+        self.joined = 0
+
+    async def do(self, key, func, status_callback=None):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(func(self._broadcaster(flight)))
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+            self.started += 1
+        else:
+            self.joined += 1
+            if status_callback is not None and flight.last_status is not None:
+                await status_callback(flight.last_status)
+
+        return await self._wait(flight, status_callback)
+
+    async def _wait(self, flight, status_callback):
+        if status_callback is not None:
+            flight.callbacks.append(status_callback)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+            if status_callback is not None:
+                flight.callbacks.remove(status_callback)
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Se todos desistiram, ninguém mais vai ler a exceção
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def _broadcaster(self, flight):
+        async def broadcast(status_text):
+            flight.last_status = status_text
+            for callback in list(flight.callbacks):
+                await callback(status_text)
+        return broadcast
+
+
+class _Batch(_Flight):
+    def __init__(self):
+        super().__init__()
+        self.counts = []
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+
+class RequestBatcher(SingleFlight):
+    """
+    Junta pedidos idênticos que ainda não começaram num único job com batch maior.
+
+    submit(chave, quantidade, func, status_callback) entra no lote aberto com a mesma chave
+    (se couber em max_batch) ou abre um novo, rodando func(seal, status).
+    func chama seal() quando o job vai de fato para o ComfyUI: o lote fecha e seal devolve
+    a quantidade total de imagens a gerar. Cada pedido recebe a sua fatia do resultado.
+
+    O resultado vem agrupado por nó de saída, cada nó com uma imagem por latent (ex: text2img
+    sem OUTPUT_NODES salva base_output e final_output): a fatia é tirada de cada grupo.
+    """
+
+    def __init__(self, max_batch=8):
+        super().__init__()
+        self.max_batch = max_batch
+
+    async def submit(self, key, count, func, status_callback=None):
+        batch = self._flights.get(key)
+        if batch is None or batch.total + count > self.max_batch:
+            batch = _Batch()
+            self._flights[key] = batch
+            batch.task = asyncio.create_task(func(lambda: self._seal(key, batch), self._broadcaster(batch)))
+            batch.task.add_done_callback(lambda _: self._finish(key, batch))
+            self.started += 1
+        else:
+            self.joined += 1
+
+        # Entra no lote antes de qualquer await, para o seal() já contar este pedido
+        start = batch.total
+        batch.counts.append(count)
+        if status_callback is not None and batch.last_status is not None:
+            await status_callback(batch.last_status)
+        images = await self._wait(batch, status_callback)
+        return self._slice(images, batch.total, start, count)
+
+    @staticmethod
+    def _slice(images, total, start, count):
+        groups, remainder = divmod(len(images), total)
+        if remainder or not groups:
+            raise ValueError(f"O lote pediu {total} imagens e voltaram {len(images)}: não dá para dividir entre os pedidos")
+        return [image for group in range(groups) for image in images[group * total + start:group * total + start + count]]
+
+    def _seal(self, key, batch):
+        if self._flights.get(key) is batch:
+            del self._flights[key]
+        return batch.total
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import math
+import time
+
+
+class StatusCoalescer:
+    """
+    Junta as edições de status ("> 🎨 Desenhando 12/25...") de todas as interações.
+
+    Para cada interação só o texto mais recente é guardado; os intermediários que
+    chegarem antes da hora de enviar são descartados (e contados em 'dropped').
+    Um único loop envia as edições respeitando:
+    - min_interval: tempo mínimo entre duas edições da mesma mensagem;
+    - max_per_second: orçamento global de edições, somando todos os jobs.
+    O discord.py trata os 429 sozinho (espera o retry_after e repete), então eles não chegam
+    como exceção: watch_rate_limits() lê os avisos do log 'discord.http', conta cada 429 e,
+    se for numa edição de interação (ou global), segura o loop pelo retry_after.
+    """
+
+    def __init__(self, min_interval=1.0, max_per_second=4.0, report_interval=300):
+        self.min_interval = min_interval
+        self.max_per_second = max_per_second
+        self.report_interval = report_interval
+        self._latest = {}       # chave -> (texto, função de edição)
+        self._last_text = {}    # chave -> último texto enviado
+        self._last_sent = {}    # chave -> horário do último envio
+        self._inflight = {}     # chave -> task da edição em andamento
+        self._next_slot = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._last_report = None
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    def update(self, key, text, edit):
+        """Agenda 'text' para a mensagem 'key'. edit(texto) é a corrotina que faz a edição."""
+        if key in self._latest:
+            self.dropped += 1
+        if text == self._last_text.get(key) and key not in self._latest:
+            return
+        self._latest[key] = (text, edit)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def finish(self, key):
+        """
+        Encerra o status de uma interação: descarta o que estiver pendente e espera a
+        edição em andamento, para ela não sobrescrever a resposta final do handler.
+        """
+        if self._latest.pop(key, None) is not None:
+            self.dropped += 1
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            await asyncio.gather(inflight, return_exceptions=True)
+        self._last_text.pop(key, None)
+        self._last_sent.pop(key, None)
+
+    def watch_rate_limits(self, logger_name='discord.http'):
+        """Passa a contar os 429 pelo log do discord.py (ele é chamado no event loop, dentro da requisição)."""
+        logging.getLogger(logger_name).addHandler(_RateLimitLogHandler(self))
+
+    def _rate_limited(self, retry_after, backoff):
+        if backoff:
+            # loop.time() do asyncio usa o mesmo relógio monotônico
+            self._next_slot = max(self._next_slot, time.monotonic() + retry_after)
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'rate_limited': self.rate_limited,
+            'pending': len(self._latest),
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self._last_report = loop.time()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            self._maybe_report(now)
+
+            # Próxima mensagem elegível: a que espera há mais tempo, respeitando o intervalo dela
+            wait = math.inf
+            chosen = None
+            for key in self._latest:
+                if key in self._inflight:
+                    continue
+                ready_at = self._last_sent.get(key, -math.inf) + self.min_interval
+                if ready_at <= now:
+                    chosen = key
+                    break
+                wait = min(wait, ready_at - now)
+
+            if chosen is not None and self._next_slot > now:
+                # Orçamento global esgotado por enquanto
+                chosen, wait = None, self._next_slot - now
+
+            if chosen is None:
+                try:
+                    timeout = None if wait == math.inf else wait
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            text, edit = self._latest.pop(chosen)
+            self._last_sent[chosen] = now
+            self._last_text[chosen] = text
+            self._next_slot = now + 1.0 / self.max_per_second
+            self._inflight[chosen] = asyncio.create_task(self._send(chosen, text, edit))
+
+    async def _send(self, key, text, edit):
+        try:
+            await edit(text)
+            self.sent += 1
+        except Exception as e:
+            self.failed += 1
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None:
+                # discord.RateLimited: espera maior que o max_ratelimit_timeout do cliente (já contada pelo log)
+                self._rate_limited(retry_after, backoff=True)
+            else:
+                print(f"Erro ao atualizar status: {e}")
+        finally:
+            self._inflight.pop(key, None)
+            self._wakeup.set()
+
+    def _maybe_report(self, now):
+        if self.report_interval and now - self._last_report >= self.report_interval:
+            self._last_report = now
+            if self.sent or self.dropped:
+                print(f"Status do Discord: {self.sent} edições enviadas, {self.dropped} descartadas, "
+                      f"{self.failed} falharam ({self.rate_limited} por rate limit)")
+
+
+class _RateLimitLogHandler(logging.Handler):
+    """Lê os avisos de 429 que o discord.http loga antes de esperar e repetir a requisição."""
+
+    def __init__(self, coalescer):
+        super().__init__(logging.WARNING)
+        self.coalescer = coalescer
+
+    def emit(self, record):
+        message = record.msg if isinstance(record.msg, str) else ''
+        args = record.args if isinstance(record.args, tuple) else ()
+        if message.startswith('We are being rate limited.') and len(args) == 3:
+            _, url, retry_after = args
+            self.coalescer.rate_limited += 1
+            # As edições de status vão para /webhooks/<app>/<token>/messages/@original
+            self.coalescer._rate_limited(retry_after, backoff='/webhooks/' in str(url))
+        elif message.startswith('Global rate limit has been hit.') and len(args) == 1:
+            self.coalescer._rate_limited(args[0], backoff=True)
@@ -0,0 +1,35 @@
+import configparser
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+CHECKPOINTS = ("anime/novaAnimeXL_ilV140.safetensors", "Real/juggernautXL_ragnarokBy.safetensors")
+
+
+@pytest.fixture(scope='session')
+def bot(tmp_path_factory):
+    """O bot.py importado com o config.properties de exemplo (o mesmo dos benchmarks), sem conectar a nada."""
+    from bench_end_to_end import CONFIG_TEMPLATE
+
+    workdir = tmp_path_factory.mktemp('bot')
+    config = configparser.ConfigParser()
+    config.read_string(CONFIG_TEMPLATE.format(servers='127.0.0.1:1', websocket_outputs='false'))
+    config['BOT'].update({'OUTPUT_DIR': str(workdir / 'out'), 'IMAGE_EXECUTOR': 'thread'})
+    config['CHECKPOINTS'] = {'FILES': ', '.join(CHECKPOINTS), 'DEFAULT': CHECKPOINTS[0]}
+    with open(workdir / 'config.properties', 'w', encoding='utf-8') as file:
+        config.write(file)
+
+    # O bot lê o config.properties da pasta atual ao ser importado
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import bot
+    finally:
+        os.chdir(previous)
+    yield bot
+    bot.image_executor.close()
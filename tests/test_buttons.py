@@ -0,0 +1,53 @@
+import asyncio
+
+import discord
+import pytest
+
+from imageHandle import ImageHandle
+
+
+def build(bot, count):
+    images = [ImageHandle(b'png %d' % index, f'{index}.png') for index in range(count)]
+
+    async def make():
+        # A View precisa de um event loop rodando
+        return bot.Buttons("prompt", "", images, "model.safetensors", 25, 6.0, "euler", "normal")
+    return asyncio.run(make())
+
+
+@pytest.mark.parametrize('count', [1, 4, 5, 6, 'max'])
+def test_buttons_fit_discord_layout(bot, count):
+    count = bot.MAX_BATCH if count == 'max' else count
+    view = build(bot, count)
+
+    rows = {}
+    for item in view.children:
+        rows[item.row] = rows.get(item.row, 0) + item.width
+    assert max(rows) <= 4
+    assert all(width <= 5 for width in rows.values())
+
+
+def test_buttons_offer_every_image_for_each_action(bot):
+    view = build(bot, bot.MAX_BATCH)
+    selects = [item for item in view.children if isinstance(item, discord.ui.Select)]
+
+    assert [[option.label for option in select.options] for select in selects] == [
+        [f"{prefix}{index + 1}" for index in range(bot.MAX_BATCH)] for prefix in ("", "V", "U")]
+
+
+def test_select_passes_the_chosen_index(bot):
+    view = build(bot, 8)
+    select = next(item for item in view.children if isinstance(item, discord.ui.Select))
+    chosen = []
+
+    async def callback(interaction, index):
+        chosen.append(index)
+    select._callback = callback
+
+    async def pick():
+        from discord.ui.select import selected_values
+        selected_values.set({select.custom_id: ['6']})
+        await select.callback(None)
+    asyncio.run(pick())
+
+    assert chosen == [6]
@@ -0,0 +1,50 @@
+import asyncio
+
+from comfyClient import ComfyClient
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def executing(client, prompt_id, node):
+    client._dispatch({'type': 'executing', 'data': {'prompt_id': prompt_id, 'node': node}})
+
+
+def test_binary_frames_without_subscriber_are_dropped():
+    async def scenario():
+        client = ComfyClient('127.0.0.1:1')
+        # Job que já saiu (cancelado/tempo esgotado): os previews dele continuam chegando
+        executing(client, 'old', '3')
+        for _ in range(100):
+            client._dispatch_binary(b'preview')
+        return client
+
+    client = run(scenario())
+    assert all(message['type'] != 'binary' for _, messages in client._orphans.values() for message in messages)
+
+
+def test_binary_frames_are_kept_until_the_job_subscribes():
+    async def scenario():
+        client = ComfyClient('127.0.0.1:1')
+        client._awaiting_subscribe['new'] = asyncio.get_running_loop().time()
+        executing(client, 'new', '9')
+        client._dispatch_binary(b'image')
+        queue = client.subscribe('new', binary_nodes=['9'])
+        return [queue.get_nowait()['type'] for _ in range(queue.qsize())]
+
+    assert run(scenario()) == ['executing', 'binary']
+
+
+def test_orphans_expire(monkeypatch):
+    import comfyClient
+    monkeypatch.setattr(comfyClient, 'ORPHAN_TTL', 0)
+
+    async def scenario():
+        client = ComfyClient('127.0.0.1:1')
+        executing(client, 'a', '3')
+        await asyncio.sleep(0.01)
+        executing(client, 'b', '3')
+        return client
+
+    assert list(run(scenario())._orphans) == ['b']
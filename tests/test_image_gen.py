@@ -0,0 +1,40 @@
+import asyncio
+
+
+class FakeClient:
+    server_address = 'fake:1'
+
+    def __init__(self):
+        self.cancelled = []
+
+    def cancel_soon(self, prompt_id):
+        self.cancelled.append(prompt_id)
+
+
+def test_cancel_during_submit_removes_the_prompt(bot):
+    import imageGen
+
+    generator = imageGen.ImageGenerator()
+    client = FakeClient()
+    accepted = asyncio.Event()
+
+    async def slow_queue(client, workflow, output_nodes):
+        await asyncio.sleep(0.05)
+        accepted.set()
+        return {'prompt_id': 'p1', 'number': 1}, []
+    generator._queue = slow_queue
+
+    async def scenario():
+        submit = asyncio.create_task(generator._queue_shielded(client, {}, ()))
+        await asyncio.sleep(0.01)
+        submit.cancel()
+        try:
+            await submit
+        except asyncio.CancelledError:
+            pass
+        assert client.cancelled == []  # o id ainda não chegou
+        await accepted.wait()
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert client.cancelled == ['p1']
@@ -0,0 +1,34 @@
+import json
+import os
+
+from outputStore import OutputStore
+
+
+def test_legacy_files_are_migrated_and_evicted(tmp_path):
+    # Layout antigo: PNGs com data no nome direto na raiz
+    (tmp_path / 'collage_20240101120000.png').write_bytes(b'a' * 100)
+    (tmp_path / 'img_20240101120000_0.png').write_bytes(b'b' * 100)
+    (tmp_path / 'img_20240101120000_1.png').write_bytes(b'a' * 100)  # mesma imagem da colagem
+    (tmp_path / 'notes.txt').write_text('fica')
+    os.utime(tmp_path / 'collage_20240101120000.png', (1, 1))
+
+    store = OutputStore(str(tmp_path), max_bytes=250)
+    store.put(b'c' * 100)
+
+    assert sorted(name for name in os.listdir(tmp_path) if os.path.isfile(tmp_path / name)) == ['index.json', 'notes.txt']
+    assert len(json.loads((tmp_path / 'index.json').read_text())) == 2
+    # O mais antigo (a colagem migrada) saiu para caber no limite
+    assert store.stats() == {'files': 2, 'bytes': 200}
+
+
+def test_cache_hit_does_not_rewrite_index(tmp_path):
+    store = OutputStore(str(tmp_path), index_save_interval=60)
+    store.put(b'x' * 10)
+    index = tmp_path / 'index.json'
+    before = index.stat().st_mtime_ns
+
+    store.put(b'x' * 10)
+    assert index.stat().st_mtime_ns == before
+
+    store.flush()
+    assert index.stat().st_mtime_ns != before
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from singleFlight import RequestBatcher
+
+
+def run_batch(counts, outputs_per_latent):
+    """Pedidos com counts entrando no mesmo lote; o job devolve outputs_per_latent imagens por latent, agrupadas por nó."""
+    batcher = RequestBatcher(max_batch=8)
+    sizes = []
+
+    async def job(seal, status):
+        await asyncio.sleep(0)
+        total = seal()
+        sizes.append(total)
+        return [f"{node}{index}" for node in 'ABC'[:outputs_per_latent] for index in range(total)]
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit('key', count, job) for count in counts))
+
+    return asyncio.run(scenario()), sizes
+
+
+def test_one_save_node():
+    results, sizes = run_batch([1, 3], 1)
+    assert sizes == [4]
+    assert results == [['A0'], ['A1', 'A2', 'A3']]
+
+
+def test_two_save_nodes_split_per_node():
+    # text2img sem OUTPUT_NODES: base_output (A) e final_output (B), cada um com o batch inteiro
+    results, sizes = run_batch([1, 3], 2)
+    assert sizes == [4]
+    assert results == [['A0', 'B0'], ['A1', 'A2', 'A3', 'B1', 'B2', 'B3']]
+
+
+def test_mismatched_output_count_raises():
+    batcher = RequestBatcher(max_batch=8)
+
+    async def job(seal, status):
+        seal()
+        return ['A0', 'A1', 'A2']
+
+    async def scenario():
+        return await asyncio.gather(batcher.submit('key', 2, job), batcher.submit('key', 2, job), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(scenario()))
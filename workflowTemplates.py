@@ -0,0 +1,118 @@
+import json
+
+# Cada "papel" de um job vira uma lista fixa de operações (nó, campo) resolvida uma vez só.
+# papel -> (chave *_NODES no config, campo pedido, converter para string (CFG), valor é texto, campo fixo)
+# "campo fixo" grava exatamente o campo pedido, sem adivinhar (usado no KSampler).
+BINDINGS = {
+    'prompt': ('PROMPT_NODES', 'text', False, True, False),
+    'negative_prompt': ('NEG_PROMPT_NODES', 'text', False, True, False),
+    'clip_skip': ('CLIP_SKIP_NODES', 'stop_at_last_layers', False, False, False),
+    'steps': ('STEPS_NODES', 'value', False, False, False),
+    'cfg': ('CFG_NODES', 'Number', True, False, False),
+    'checkpoint': ('CHECKPOINT_NODES', 'ckpt_name', False, True, False),
+    'seed': ('RAND_SEED_NODES', 'seed', False, False, False),
+    'image': ('FILE_INPUT_NODES', 'image', False, True, False),
+    'upscale_model': ('UPSCALE_MODEL_NODES', 'model_name', False, True, False),
+    'sampler': ('SAMPLER_NODES', 'sampler_name', False, True, True),
+    'scheduler': ('SAMPLER_NODES', 'scheduler', False, True, True),
+    'batch_size': ('BATCH_NODES', 'batch_size', False, False, False),
+}
+
+# Sem BATCH_NODES no config, o batch_size vai para os nós de latent vazio do workflow
+LATENT_NODE_CLASSES = ('EmptyLatentImage', 'EmptySD3LatentImage')
+
+
+def parse_node_ids(nodes_str):
+    """Transforma "89, 90" do config em ['89', '90']."""
+    if not nodes_str:
+        return []
+    return [n.strip() for n in nodes_str.split(',') if n.strip()]
+
+
+def resolve_field(inputs, field_key, is_string_number=False, is_text=False):
+    """
+    Descobre em qual campo do nó o valor deve ser gravado.
+    Tenta ser inteligente sobre o nome do campo se field_key for genérico.
+    Devolve (campo, converter_para_string) ou None se o nó não tiver nada compatível.
+    """
+    # Se o campo solicitado existe, usa ele
+    if field_key in inputs:
+        return field_key, is_string_number
+    # Se não, tenta adivinhar campos comuns para Primitives
+    if 'value' in inputs:
+        return 'value', is_string_number
+    if 'Number' in inputs:  # Caso específico do nó Float to String
+        return 'Number', True
+    if 'text' in inputs and is_text:
+        return 'text', False
+    if 'string_b' in inputs and is_text:  # Concatenate
+        return 'string_b', False
+    return None
+
+
+class WorkflowTemplate:
+    """
+    Workflow de uma seção do config (ex: LOCAL_TEXT2IMG), lido do disco uma única vez.
+    Todos os *_NODES são resolvidos na carga em planos (nó, campo, converter),
+    e cada job é montado com uma cópia rasa + patch só dos nós alterados.
+    """
+
+    def __init__(self, section, settings):
+        self.section = section
+        self.settings = settings
+        self.path = settings['CONFIG']
+        with open(self.path, 'r', encoding='utf-8') as file:
+            self.workflow = json.load(file)
+        self.plans = {role: self._compile(*binding) for role, binding in BINDINGS.items()}
+        if not self.plans['batch_size']:
+            self.plans['batch_size'] = tuple(
+                (node_id, 'batch_size', False) for node_id, node in self.workflow.items()
+                if node.get('class_type') in LATENT_NODE_CLASSES and 'batch_size' in node.get('inputs', {})
+            )
+        # Nós cujas imagens são o resultado do job (vazio = todas as imagens de saída)
+        self.output_nodes = tuple(node_id for node_id in self.node_ids('OUTPUT_NODES') if node_id in self.workflow)
+
+    def node_ids(self, key):
+        return parse_node_ids(self.settings.get(key, fallback=''))
+
+    def _compile(self, key, field_key, is_string_number, is_text, fixed_field):
+        plan = []
+        for node_id in self.node_ids(key):
+            if node_id not in self.workflow:
+                continue
+            if fixed_field:
+                plan.append((node_id, field_key, False))
+                continue
+            resolved = resolve_field(self.workflow[node_id]['inputs'], field_key, is_string_number, is_text)
+            if resolved:
+                plan.append((node_id, *resolved))
+        return tuple(plan)
+
+    def new_job(self):
+        return WorkflowJob(self)
+
+
+class WorkflowJob:
+    """Workflow de um job: compartilha os nós do template e copia só os que forem alterados."""
+
+    def __init__(self, template):
+        self.template = template
+        self.workflow = dict(template.workflow)
+        self._copied = set()
+
+    def inputs(self, node_id):
+        # Copy-on-write: o template nunca pode ser alterado por um job
+        if node_id not in self._copied:
+            node = self.workflow[node_id]
+            self.workflow[node_id] = {**node, 'inputs': dict(node['inputs'])}
+            self._copied.add(node_id)
+        return self.workflow[node_id]['inputs']
+
+    def set(self, role, value):
+        for node_id, field, to_str in self.template.plans[role]:
+            self.inputs(node_id)[field] = str(value) if to_str else value
+
+
+def load_templates(config, sections):
+    """Carrega os templates das seções pedidas (chamado uma vez na inicialização)."""
+    return {section: WorkflowTemplate(section, config[section]) for section in sections}